@@ -1,14 +1,29 @@
 # api/main.py
 from __future__ import annotations
 
+import asyncio
+from pathlib import Path
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 from api.routes import router
 from service.settings import Settings
-from service.model_manager import init_engines
+from service.model_manager import init_engines, shared_gpus, shutdown_engines
+from service.mps import ensure_mps_daemon
+from service.workers import prepare_tmp_root, sweep_stale
 import quiet
 
+# NOTE:
+# uvloop cuts per-callback overhead of the event loop, which keeps the control
+# endpoints snappy while uploads and job hand-offs are in flight. Optional;
+# the default asyncio loop is used where it is unavailable (e.g. Windows).
+try:
+    import uvloop
+except ImportError:
+    pass
+else:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
 TAGS_METADATA = [
     {
         "name": "system",
@@ -32,6 +47,25 @@ def create_app() -> FastAPI:
         By doing so, we don't have to reload or reinitialize the models for each request.
         """
         s = Settings()
+
+        # Remove work directories left behind by a previous process
+        work_root = prepare_tmp_root(Path(s.tmp_root))
+        sweep_stale(work_root, max_age_s=s.stale_workdir_minutes * 60)
+        app.state.work_root = work_root
+
+        # NOTE:
+        # Engines sharing one GPU only run concurrently under CUDA MPS; without it
+        # their contexts time-slice. With MPS on, admit two jobs unless configured
+        # otherwise so one job's OCR overlaps another's captioning.
+        gpu_slots = s.gpu_slots
+        use_mps = (
+            s.enable_mps
+            and bool(shared_gpus(s.ocr_device, s.vl2_device))
+            and ensure_mps_daemon()
+        )
+        if use_mps and "gpu_slots" not in s.model_fields_set:
+            gpu_slots = 2
+
         with quiet.quiet_stdio():
             init_engines(
                 ocr_model=s.model_ocr,
@@ -39,11 +73,28 @@ def create_app() -> FastAPI:
                 gpu_mem_ocr=s.gpu_mem_ocr,
                 gpu_mem_vl2=s.gpu_mem_vl2,
                 seed=s.seed,
-                gpu_slots=s.gpu_slots,
+                gpu_slots=gpu_slots,
+                ocr_replicas=s.ocr_replicas,
+                vl2_replicas=s.vl2_replicas,
                 ocr_device=s.ocr_device,
                 vl2_device=s.vl2_device,
+                vl2_max_num_seqs=s.vl2_max_num_seqs,
+                vl2_mm_cache_gb=s.vl2_mm_cache_gb,
+                enable_prefix_caching=s.enable_prefix_caching,
+                vl2_quantization=s.model_vl2_quant,
+                ocr_quantization=s.model_ocr_quant,
+                caption_cache_dir=s.caption_cache_dir if s.caption_cache_enabled else None,
+                warmup=s.warmup,
+                work_root=str(work_root),
+                caption_batch_max=s.caption_batch_max,
+                caption_batch_wait_ms=s.caption_batch_wait_ms,
+                mps_thread_percentage=s.mps_thread_percentage if use_mps else None,
+                pin_numa=s.pin_numa,
             )
-        yield
+        try:
+            yield
+        finally:
+            shutdown_engines()
 
     app = FastAPI(
         title="pdfscribe2ds-fastapi", 
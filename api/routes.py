@@ -3,18 +3,48 @@ from __future__ import annotations
 
 import asyncio
 from pathlib import Path
+import anyio
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
 from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
 from caption_pipeline.caption_pipeline import CaptionRewrite
+from ocr_pipeline.pdf_loader import pdf_page_count
 
-from service.model_manager import get_engines, engines_busy, try_admit_now, try_admit_with_timeout
+from service.model_manager import (
+    get_engines, engines_busy, ocr_busy, vl2_busy, try_admit_now, try_admit_with_timeout,
+)
 from service.pipeline import process_pdf
-from service.workers import zip_dir
+from service.workers import ScratchPool, save_upload, zip_dir
 
 from api.schemas import HealthResponse, StatusResponse, ErrorResponse
 
 router = APIRouter()
 
+class ScratchFileResponse(FileResponse):
+    """
+    FileResponse for an archive inside a rented scratch directory, which is
+    given back to the pool once sending ends, whether it succeeded or not.
+    Unlike a background task, this also runs when the client disconnects
+    mid-download or the Range header is rejected.
+    """
+    def __init__(self, *args, scratch: ScratchPool, workdir: Path, **kwargs) -> None:
+        """
+        Args:
+            scratch (ScratchPool): The pool the work directory was rented from.
+            workdir (Path): The work directory holding the file.
+        """
+        super().__init__(*args, **kwargs)
+        self.scratch = scratch
+        self.workdir = workdir
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # NOTE: Shielded so a cancelled (disconnected) request still cleans up
+            with anyio.CancelScope(shield=True):
+                await self.scratch.give_back(self.workdir)
+
 async def _cancel_on_disconnect(request: Request, cancel_evt: asyncio.Event) -> None:
     """
     If the client disconnects, set the cancel event.
@@ -49,7 +79,11 @@ def models_status():
     return StatusResponse(
         ocr_model=e.ocr.model_name,
         vl2_model=e.vl2.cfg.model_name,
-        busy=engines_busy()
+        busy=engines_busy(),
+        in_flight=e.in_flight,
+        capacity=e.gpu_slots,
+        ocr_busy=ocr_busy(),
+        vl2_busy=vl2_busy(),
     )
 
 @router.post(
@@ -111,57 +145,90 @@ async def process_pdf_endpoint(
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDF files are supported.")
-    pdf_bytes = await file.read()
-    if not pdf_bytes:
-        raise HTTPException(status_code=400, detail="Empty file uploaded.")
-
-    # Admission policy
-    if not wait_if_busy:
-        ok = await try_admit_now()
-        if not ok:
-            raise HTTPException(
-                status_code=429,
-                detail="GPU is busy with another PDF processing request; try again shortly",
-                headers={"Retry-After": "15"},
-            )
-    else:
-        ok = await try_admit_with_timeout(timeout_s=timeout_s)
-        if not ok:
-            raise HTTPException(
-                status_code=503,
-                detail=f"GPU is still busy after waiting for {timeout_s:.1f} seconds; try again later",
-                headers={"Retry-After": "30"},
-            )
-
-    rewrite = CaptionRewrite.APPEND if rewrite_mode == "append" else CaptionRewrite.REPLACE
-    tmp_root = Path("/tmp/pdfscribe2ds-fastapi")
-    tmp_root.mkdir(parents=True, exist_ok=True)
-
-    # NOTE: Cancel PDF process job when client disconnects
-    cancel_evt = asyncio.Event()
-    watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_evt))
+
+    work_root: Path = request.app.state.work_root
+
+    # NOTE:
+    # Stream the upload to disk in fixed-size chunks instead of buffering
+    # the whole PDF in memory. The whole copy runs in one worker thread
+    # rather than hopping threads per chunk. The input is not part of the
+    # response, so it is removed as soon as processing ends (successfully or not).
+    pdf_path, size = await asyncio.to_thread(save_upload, file.file, work_root)
     try:
-        # Receive the output and archive it into a zip file
-        out_dir = await process_pdf(
-            tmp_root=tmp_root, 
-            pdf_bytes=pdf_bytes, 
-            dpi=dpi, 
-            rewrite=rewrite, 
-            seed=seed,
-            cancel_evt=cancel_evt
-        )
-    except asyncio.CancelledError:
-        raise HTTPException(status_code=499, detail="Client closed request.")
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file uploaded.")
+
+        # NOTE: Reject trivial inputs before they take a GPU admission slot
+        try:
+            page_count = await asyncio.to_thread(pdf_page_count, pdf_path)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Uploaded file is not a readable PDF.")
+        if page_count == 0:
+            raise HTTPException(status_code=400, detail="PDF has no pages.")
+
+        # Admission policy
+        # NOTE: The acquired slot is held until the GPU work is done
+        if not wait_if_busy:
+            slot = await try_admit_now()
+            if slot is None:
+                raise HTTPException(
+                    status_code=429,
+                    detail="GPU is busy with another PDF processing request; try again shortly",
+                    headers={"Retry-After": "15"},
+                )
+        else:
+            slot = await try_admit_with_timeout(timeout_s=timeout_s)
+            if slot is None:
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"GPU is still busy after waiting for {timeout_s:.1f} seconds; try again later",
+                    headers={"Retry-After": "30"},
+                )
+
+        async with slot:
+            rewrite = CaptionRewrite.APPEND if rewrite_mode == "append" else CaptionRewrite.REPLACE
+
+            # NOTE: Cancel PDF process job when client disconnects
+            cancel_evt = asyncio.Event()
+            watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_evt))
+            try:
+                # Receive the output and archive it into a zip file
+                out_dir = await process_pdf(
+                    pdf_path=pdf_path, 
+                    dpi=dpi, 
+                    rewrite=rewrite, 
+                    seed=seed,
+                    cancel_evt=cancel_evt
+                )
+            except asyncio.CancelledError:
+                raise HTTPException(status_code=499, detail="Client closed request.")
+            finally:
+                watcher.cancel()
     finally:
-        watcher.cancel()
-
-    archive_path = zip_dir(
-        src=out_dir, 
-        dest_zip_stem=out_dir.parent / "result"
-    )
+        pdf_path.unlink(missing_ok=True)
+
+    # NOTE:
+    # The work directory (outputs + archive) is emptied and returned to the
+    # scratch pool once sending ends (see ScratchFileResponse), so /tmp
+    # (often tmpfs) does not grow with every request.
+    # Zipping many page assets takes seconds; keep the event loop responsive
+    scratch = get_engines().scratch
+    workdir = out_dir.parent
+    try:
+        archive_path = await asyncio.to_thread(
+            zip_dir,
+            src=out_dir, 
+            dest_zip_stem=workdir / "result"
+        )
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await scratch.discard(workdir)
+        raise
 
-    return FileResponse(
+    return ScratchFileResponse(
         path=str(archive_path),
         media_type="application/zip",
         filename=f"{(file.filename or 'document').rsplit('.',1)[0]}_markdown.zip",
+        scratch=scratch,
+        workdir=workdir,
     )
@@ -12,6 +12,10 @@ class StatusResponse(BaseModel):
     ocr_model: str
     vl2_model: str
     busy: bool
+    in_flight: int # jobs currently holding an admission slot
+    capacity: int # admission slots in total (GPU_SLOTS)
+    ocr_busy: bool
+    vl2_busy: bool
 
 class ErrorResponse(BaseModel):
     detail: str = Field(..., example="GPU stayed busy for 60.0s; try again later.") # type: ignore
@@ -0,0 +1,179 @@
+# caption_pipeline/caption_cache.py
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+# NOTE:
+# BLAKE2b is several times faster than SHA-256 on large inputs and ships with
+# hashlib; 128-bit digests are plenty for content addressing.
+_DIGEST_SIZE = 16
+
+def _digest(data: bytes) -> str:
+    """
+    Hex BLAKE2b digest of the given bytes.
+    """
+    return hashlib.blake2b(data, digest_size=_DIGEST_SIZE).hexdigest()
+
+def prompt_digest(prompt: Optional[str]) -> str:
+    """
+    Hash the caption prompt so it can be folded into a cache key.
+
+    Args:
+        prompt (Optional[str]): The prompt override, or None for the default prompt.
+
+    Returns:
+        str: Hex BLAKE2b digest of the prompt.
+    """
+    return _digest((prompt or "").encode("utf-8"))
+
+def cache_key(image_bytes: bytes, prompt_hash: str) -> str:
+    """
+    Build a cache key from the raw image bytes and a prompt digest.
+
+    Args:
+        image_bytes (bytes): Encoded image file content.
+        prompt_hash (str): Digest returned by `prompt_digest`.
+
+    Returns:
+        str: Cache key in the form "<image digest>:<prompt digest>".
+    """
+    return f"{_digest(image_bytes)}:{prompt_hash}"
+
+class CaptionCache:
+    """
+    Persistent caption store keyed by image content and prompt hashes.
+    Identical figures (logos, watermarks, repeated diagrams) across pages and PDFs
+    are captioned once; later hits skip the VL2 model entirely.
+
+    Backed by SQLite so the cache survives restarts, with an in-memory LRU in
+    front for hot entries. Least-recently-used entries are pruned once the store
+    grows beyond `max_entries`. Entries are scoped to a model name, so switching
+    the captioning model never serves captions of the previous one.
+    """
+    _PRUNE_EVERY = 1024  # writes between prune passes
+
+    def __init__(
+        self,
+        root: Path,
+        max_entries: int = 100_000,
+        model_name: str = "",
+        memory_entries: int = 10_000,
+    ) -> None:
+        """
+        Args:
+            root (Path): Directory holding the SQLite database.
+            max_entries (int): Upper bound on stored captions before LRU pruning.
+            model_name (str): Captioning model the entries belong to.
+            memory_entries (int): Number of captions kept in memory (0 disables the memory tier).
+        """
+        root.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self.memory_entries = memory_entries
+        self._writes = 0
+        self._memory: OrderedDict[str, str] = OrderedDict()
+
+        # NOTE:
+        # Captioning runs in worker threads, so share one connection behind a lock.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(root / "captions.sqlite"),
+            check_same_thread=False,
+            isolation_level=None, # autocommit
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            "key TEXT PRIMARY KEY, caption TEXT NOT NULL, atime REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS captions_atime ON captions(atime)")
+
+    def _scoped(self, key: str) -> str:
+        """
+        Prefix a key with the model name.
+        """
+        return f"{self.model_name}|{key}" if self.model_name else key
+
+    def _remember(self, key: str, caption: str) -> None:
+        """
+        Put an entry into the memory tier, evicting the oldest. Caller holds the lock.
+        """
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = caption
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached caption and refresh its access time.
+
+        Args:
+            key (str): Key built by `cache_key`.
+
+        Returns:
+            Optional[str]: The cached caption, or None on a miss.
+        """
+        key = self._scoped(key)
+        with self._lock:
+            # NOTE:
+            # Memory hits skip SQLite entirely, including the atime refresh;
+            # hot entries are rewritten there again on their next disk hit.
+            caption = self._memory.get(key)
+            if caption is not None:
+                self._memory.move_to_end(key)
+                return caption
+
+            row = self._conn.execute(
+                "SELECT caption FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE captions SET atime = ? WHERE key = ?", (time.time(), key)
+            )
+            self._remember(key, row[0])
+            return row[0]
+
+    def set(self, key: str, caption: str) -> None:
+        """
+        Store a caption, pruning the oldest entries from time to time.
+
+        Args:
+            key (str): Key built by `cache_key`.
+            caption (str): The generated caption text.
+        """
+        key = self._scoped(key)
+        with self._lock:
+            self._remember(key, caption)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (key, caption, atime) VALUES (?, ?, ?)",
+                (key, caption, time.time()),
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self) -> None:
+        """
+        Drop least-recently-used entries beyond `max_entries`. Caller holds the lock.
+        """
+        self._conn.execute(
+            "DELETE FROM captions WHERE key IN ("
+            "SELECT key FROM captions ORDER BY atime DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self) -> None:
+        """
+        Close the underlying database connection.
+        """
+        with self._lock:
+            self._conn.close()
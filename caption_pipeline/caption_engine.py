@@ -1,11 +1,14 @@
 # caption_pipeline/caption_engine.py
 from __future__ import annotations
 
-from dataclasses import asdict, dataclass
-from typing import Optional
+import logging
+from dataclasses import asdict, dataclass, replace
+from typing import List, Optional, Sequence
 from PIL import Image, ImageOps
 from vllm import LLM, EngineArgs, SamplingParams
 
+logger = logging.getLogger("pdfscribe2ds")
+
 @dataclass(frozen=True)
 class CaptionerConfig:
     model_name: str = "deepseek-ai/deepseek-vl2-tiny" # fixed
@@ -15,6 +18,18 @@ class CaptionerConfig:
     seed: Optional[int] = None
     min_side: int = 128 # ensure min(H, W) >= this
     max_side: int = 2048 # avoid absurdly large images
+    # NOTE:
+    # vLLM keys processed image inputs by content hash; a repeated image
+    # (even under a different prompt) skips re-processing. 0 disables it.
+    mm_processor_cache_gb: float = 4.0
+    # NOTE:
+    # Reuse the KV cache of the shared prompt prefix (instruction + page context)
+    # across all images of a page; only the image tokens onward are prefilled.
+    enable_prefix_caching: bool = True
+    # NOTE:
+    # vLLM quantization method (e.g. "awq", "bitsandbytes", "fp8"); None keeps the
+    # checkpoint's dtype. Pre-quantized methods need a matching checkpoint.
+    quantization: Optional[str] = None
 
     def to_engine_args(self) -> EngineArgs:
         """
@@ -31,6 +46,9 @@ class CaptionerConfig:
             gpu_memory_utilization=self.gpu_memory_utilization,
             hf_overrides={"architectures": ["DeepseekVLV2ForCausalLM"]},
             limit_mm_per_prompt={"image": 1},
+            mm_processor_cache_gb=self.mm_processor_cache_gb,
+            enable_prefix_caching=self.enable_prefix_caching,
+            quantization=self.quantization,
             seed=self.seed
         )
 
@@ -92,15 +110,22 @@ def _truncate_context(ctx: str, max_chars: int = 4000) -> str:
 class DeepSeekVL2Captioner:
     """
     Thin captioner for DeepSeek-VL2 (tiny by default). Produces concise,
-    technical-report-friendly captions for a single PIL image.
+    technical-report-friendly captions for PIL images, one at a time or in batches.
     """
     def __init__(self, cfg: CaptionerConfig = CaptionerConfig()) -> None:
+        try:
+            self.llm = self._load(cfg)
+        except Exception as e:
+            if cfg.quantization is None:
+                raise
+            # Quantized weights unavailable for this model/GPU; fall back to full precision
+            logger.warning(
+                "Failed to load %s with quantization=%s (%s); falling back to unquantized weights",
+                cfg.model_name, cfg.quantization, e,
+            )
+            cfg = replace(cfg, quantization=None)
+            self.llm = self._load(cfg)
         self.cfg = cfg
-        engine_dict = cfg.to_engine_args()
-
-        # vLLM's LLM constructor accepts `seed` directly
-        extra = {"seed": self.cfg.seed} if cfg.seed is not None else {}
-        self.llm = LLM(**(asdict(engine_dict) | extra))
 
         # Default instruction
         self.default_instruction = (
@@ -111,10 +136,13 @@ class DeepSeekVL2Captioner:
         )
 
         # Role tokens kept consistent with your current style
+        # NOTE:
+        # Stable parts first (instruction, then page context), image last, so that
+        # every image of a page shares the longest possible cacheable prefix.
         self.user_template = (
-            "<|User|>: image_1:<image>\n"
+            "<|User|>: {instruction}\n\n"
             "CONTEXT (page markdown):\n{context}\n\n"
-            "{instruction}\n\n"
+            "image_1:<image>\n"
             "<|Assistant|>:"
         )
 
@@ -123,6 +151,23 @@ class DeepSeekVL2Captioner:
             max_tokens=256,
         )
 
+    @staticmethod
+    def _load(cfg: CaptionerConfig) -> LLM:
+        """
+        Create the vLLM engine for the given configuration.
+
+        Args:
+            cfg (CaptionerConfig): The captioner configuration.
+
+        Returns:
+            LLM: The loaded vLLM engine.
+        """
+        engine_dict = cfg.to_engine_args()
+
+        # vLLM's LLM constructor accepts `seed` directly
+        extra = {"seed": cfg.seed} if cfg.seed is not None else {}
+        return LLM(**(asdict(engine_dict) | extra))
+
     def _build_prompt(self, page_context: str, instruction: str) -> str:
         """
         Build the prompt for the captioning task.
@@ -137,6 +182,21 @@ class DeepSeekVL2Captioner:
         ctx = _truncate_context(page_context or "")
         return self.user_template.format(context=ctx, instruction=instruction)
 
+    def build_prompt(self, page_context: str = "", prompt_override: str | None = None) -> str:
+        """
+        Build the full captioning prompt for a page. Callers captioning several
+        images of the same page build it once and pass it to `caption_prompts`.
+
+        Args:
+            page_context (str): Optional context of the page in markdown format.
+            prompt_override (str | None): Optional custom prompt to use instead of the default.
+
+        Returns:
+            str: The constructed prompt string.
+        """
+        instruction = prompt_override or self.default_instruction
+        return self._build_prompt(page_context=page_context, instruction=instruction)
+
     def caption(self, 
                 image: Image.Image, 
                 page_context: str = "",
@@ -152,16 +212,77 @@ class DeepSeekVL2Captioner:
         Returns:
             str: The generated caption text.
         """
-        instruction = prompt_override or self.default_instruction
-        prompt = self._build_prompt(page_context=page_context, instruction=instruction)
-        safe_image = _prepare_image_for_vl2(image, self.cfg.min_side, self.cfg.max_side)
+        return self.caption_batch(
+            [image],
+            page_context=page_context,
+            prompt_override=prompt_override,
+        )[0]
 
-        outputs = self.llm.generate(
+    def caption_batch(self,
+                      images: Sequence[Image.Image],
+                      page_context: str = "",
+                      prompt_override: str | None = None) -> List[str]:
+        """
+        Generate captions for several images sharing the same page context
+        in a single vLLM call, so the engine can batch prefill/decode across them.
+
+        Args:
+            images (Sequence[PIL.Image]): The input images to caption.
+            page_context (str): Optional context of the page in markdown format.
+            prompt_override (str | None): Optional custom prompt to use instead of the default.
+
+        Returns:
+            List[str]: The generated caption texts, in the same order as `images`.
+        """
+        prompt = self.build_prompt(page_context=page_context, prompt_override=prompt_override)
+        return self.caption_prompts(images, [prompt] * len(images))
+
+    def caption_prompts(self,
+                        images: Sequence[Image.Image],
+                        prompts: Sequence[str]) -> List[str]:
+        """
+        Generate captions for images with prebuilt prompts (see `build_prompt`),
+        one prompt per image, in a single vLLM call.
+
+        Args:
+            images (Sequence[PIL.Image]): The input images to caption.
+            prompts (Sequence[str]): The prompt for each image.
+
+        Returns:
+            List[str]: The generated caption texts, in the same order as `images`.
+        """
+        if len(images) != len(prompts):
+            raise ValueError(f"Got {len(images)} image(s) but {len(prompts)} prompt(s)")
+        if not images:
+            return []
+
+        requests = [
             {
                 "prompt": prompt,
-                "multi_modal_data": {"image": [safe_image]},  # list[PIL.Image]
-            },
+                "multi_modal_data": {
+                    "image": [_prepare_image_for_vl2(image, self.cfg.min_side, self.cfg.max_side)]
+                },  # list[PIL.Image]
+            }
+            for image, prompt in zip(images, prompts)
+        ]
+
+        # NOTE: vLLM returns outputs in request order
+        outputs = self.llm.generate(
+            requests,
             sampling_params=self.sampling,
             use_tqdm=False
         )
-        return outputs[0].outputs[0].text.strip()
+        return [o.outputs[0].text.strip() for o in outputs]
+
+    def warmup(self) -> None:
+        """
+        Caption a blank image with a short generation budget so one-time costs
+        (multimodal processor setup, kernel selection, CUDA graph capture) are
+        paid at startup instead of by the first request.
+        """
+        image = Image.new("RGB", (self.cfg.min_side, self.cfg.min_side), "white")
+        self.llm.generate(
+            [{"prompt": self.build_prompt(), "multi_modal_data": {"image": [image]}}],
+            sampling_params=SamplingParams(temperature=0.0, max_tokens=8),
+            use_tqdm=False,
+        )
@@ -3,20 +3,31 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import mmap
+import os
 import re
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 from enum import Enum
 
 from PIL import Image
 import quiet
 
-from .caption_engine import DeepSeekVL2Captioner, CaptionerConfig
+from .caption_cache import CaptionCache, cache_key, prompt_digest
+
+if TYPE_CHECKING:
+    from .caption_engine import DeepSeekVL2Captioner
+
+# Generates one caption per (image, prompt) pair, e.g. `DeepSeekVL2Captioner.caption_prompts`
+CaptionFn = Callable[[Sequence[Image.Image], Sequence[str]], List[str]]
 
 logger = logging.getLogger("pdfscribe2ds")
 
 # Markdown image pattern: ![ALT](PATH)
 _IMG_TAG = re.compile(r'!\[(.*?)\]\((.*?)\)')
+# Same pattern on raw bytes, to probe files without decoding them
+_IMG_TAG_BYTES = re.compile(rb'!\[(.*?)\]\((.*?)\)')
 
 class CaptionRewrite(str, Enum):
     APPEND = "append"
@@ -37,6 +48,66 @@ def _render_caption_block(alt: str, cap: str) -> str:
 
     return f"\n\n*{prefix} - {cap}*\n"
 
+def _render_replace(tag: str, alt: str, cap: str) -> str:
+    """
+    REPLACE mode: drop the image tag and keep only the caption line.
+
+    Args:
+        tag (str): The original image tag.
+        alt (str): The alt text of the image.
+        cap (str): The generated caption for the image.
+
+    Returns:
+        str: The replacement text for the tag.
+    """
+    return f"{(alt or 'Image').strip()} (Interpreted and captioned): {cap}"
+
+def _render_append(tag: str, alt: str, cap: str) -> str:
+    """
+    APPEND mode: keep the original image tag and add a caption block after it.
+
+    Args:
+        tag (str): The original image tag.
+        alt (str): The alt text of the image.
+        cap (str): The generated caption for the image.
+
+    Returns:
+        str: The replacement text for the tag.
+    """
+    return f"{tag}{_render_caption_block(alt, cap)}"
+
+def _load_rgb(img_path: Path) -> Image.Image:
+    """
+    Decode an image fully into memory as RGB, closing the file immediately.
+    Crops written by the OCR stage are already RGB, so no converted copy is made.
+
+    Args:
+        img_path (Path): Path to the image file.
+
+    Returns:
+        Image.Image: The decoded RGB image.
+    """
+    with Image.open(img_path) as image:
+        image.load()
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+def _has_image_tag(md_file: Path) -> bool:
+    """
+    Check whether a Markdown file contains an image tag by scanning a read-only
+    memory map of its bytes, without reading it into a Python string.
+
+    Args:
+        md_file (Path): The markdown file to probe.
+
+    Returns:
+        bool: True if at least one image tag is present.
+    """
+    with md_file.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _IMG_TAG_BYTES.search(mm) is not None
+
 def _resolve_image(md_file: Path, rel_path: str) -> Path:
     """
     Resolve a relative image path to an absolute path based on the markdown file location.
@@ -51,84 +122,311 @@ def _resolve_image(md_file: Path, rel_path: str) -> Path:
     rel_path = rel_path.strip()
     return (md_file.parent / rel_path).resolve()
 
-def caption_markdown_file(
+@dataclass
+class _MarkdownPage:
+    """
+    A Markdown file with image tags, collected before any captioning happens.
+    """
+    md_file: Path
+    text: str
+    prompt: str # caption prompt built from this page's context
+    tags: Dict[Tuple[str, str], str] # unique (alt, rel) --> original tag text
+    images: Dict[str, Path] = field(default_factory=dict) # rel --> resolved existing image
+
+def _collect_page(
     md_file: Path,
     captioner: DeepSeekVL2Captioner,
-    prompt_override: Optional[str] = None,
-    rewrite: CaptionRewrite = CaptionRewrite.APPEND,
-    cancel_evt: Optional[asyncio.Event] = None,
-) -> bool:
+    prompt_override: Optional[str],
+) -> Optional[_MarkdownPage]:
     """
-    Read a single Markdown file, caption each image tag, and rewrite the file in place.
-    Returns True if the file changed, else False.
+    Read a Markdown file and gather its image tags and resolved image paths.
 
     Args:
-        md_file (Path): The markdown file to process.
-        captioner (DeepSeekVL2Captioner): The captioner instance to use for generating captions.
+        md_file (Path): The markdown file to read.
+        captioner (DeepSeekVL2Captioner): The captioner, used to build the page prompt.
         prompt_override (Optional[str]): Optional prompt to override the default captioning prompt.
-        rewrite (CaptionRewrite): Whether to append or replace captions in the markdown.
-        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
 
     Returns:
-        bool: True if the file was modified, False otherwise.
+        Optional[_MarkdownPage]: The collected page, or None if it has no image tags.
     """
-    text = md_file.read_text(encoding="utf-8")
-    matches = list(_IMG_TAG.finditer(text))
-    if not matches:
+    # NOTE:
+    # Cheap probe first; most pages have no images at all, and those are
+    # never decoded into a string
+    if not _has_image_tag(md_file):
         logger.info("No images found in %s", md_file.name)
-        return False
+        return None
 
-    # caption each unique image once
-    captions_cache: Dict[str, str] = {}
+    text = md_file.read_text(encoding="utf-8")
 
-    for m in matches:
+    page = _MarkdownPage(
+        md_file=md_file,
+        text=text,
+        # NOTE: The page context is the same for every image; build the prompt once
+        prompt=captioner.build_prompt(page_context=text, prompt_override=prompt_override),
+        tags={(m.group(1), m.group(2)): m.group(0) for m in _IMG_TAG.finditer(text)},
+    )
+    for rel in dict.fromkeys(rel for _, rel in page.tags):
+        img_path = _resolve_image(md_file, rel)
+        if not img_path.exists():
+            logger.warning("Image not found: %s (referenced in %s)", img_path, md_file)
+            continue
+        page.images[rel] = img_path
+    return page
+
+def _caption_images(
+    pages: List[_MarkdownPage],
+    caption_fn: CaptionFn,
+    prompt_override: Optional[str],
+    cancel_evt: Optional[asyncio.Event],
+    caption_cache: Optional[CaptionCache],
+    batch_size: int,
+    retry_per_image: bool = True,
+) -> Dict[Path, str]:
+    """
+    Caption every unique image referenced by the given pages, batching images
+    across pages so the engine sees as many requests at once as possible.
+
+    Args:
+        pages (List[_MarkdownPage]): The collected pages.
+        caption_fn (CaptionFn): Generates captions for a batch of images and their prompts.
+        prompt_override (Optional[str]): Optional prompt to override the default captioning prompt.
+        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
+        caption_cache (Optional[CaptionCache]): Optional persistent cache keyed by image content.
+        batch_size (int): Maximum number of images decoded and submitted per engine call.
+        retry_per_image (bool): Retry a failed batch one image at a time; off when
+                                `caption_fn` already isolates failures per image.
+
+    Returns:
+        Dict[Path, str]: Caption for each successfully captioned image path.
+    """
+    captions: Dict[Path, str] = {}
+    prompt_hash = prompt_digest(prompt_override) if caption_cache is not None else ""
+
+    # Each image is captioned once, with the context of the first page referencing it
+    todo: Dict[Path, str] = {}
+    for page in pages:
+        for img_path in page.images.values():
+            todo.setdefault(img_path, page.prompt)
+
+    # 1. Resolve persistent cache hits; identical content is captioned only once
+    pending: List[Tuple[Path, str, Optional[str]]] = [] # (path, prompt, cache key)
+    duplicates: Dict[str, List[Path]] = {} # cache key --> other paths with that content
+    for img_path, prompt in todo.items():
         if cancel_evt and cancel_evt.is_set():
             raise asyncio.CancelledError()
 
-        # alt = m.group(1)
-        rel = m.group(2)
-        if rel in captions_cache:
-            continue
+        key = None
+        if caption_cache is not None:
+            try:
+                key = cache_key(img_path.read_bytes(), prompt_hash)
+            except OSError as e:
+                logger.error("Failed to read image %s: %s", img_path, e)
+                continue
+            # NOTE:
+            # Identical images across pages/PDFs hit the persistent cache
+            # and never reach the GPU.
+            cached = caption_cache.get(key)
+            if cached is not None:
+                captions[img_path] = cached
+                logger.info("Caption cache hit: %s", img_path)
+                continue
+            if key in duplicates:
+                duplicates[key].append(img_path)
+                continue
+            duplicates[key] = []
+        pending.append((img_path, prompt, key))
 
-        img_path = _resolve_image(md_file, rel)
-        if not img_path.exists():
-            logger.warning("Image not found: %s (referenced in %s)", img_path, md_file)
+    # 2. Caption the rest in batched engine calls
+    for start in range(0, len(pending), batch_size):
+        if cancel_evt and cancel_evt.is_set():
+            raise asyncio.CancelledError()
+
+        chunk: List[Tuple[Path, str, Optional[str]]] = []
+        images: List[Image.Image] = []
+        for img_path, prompt, key in pending[start:start + batch_size]:
+            try:
+                images.append(_load_rgb(img_path))
+                chunk.append((img_path, prompt, key))
+            except Exception as e:
+                logger.error("Failed to load image %s: %s", img_path, e)
+        if not chunk:
             continue
 
+        prompts = [prompt for _, prompt, _ in chunk]
         try:
-            with Image.open(img_path) as image:
-                with quiet.quiet_stdio():
-                    cap = captioner.caption(
-                        image.convert("RGB"),
-                        page_context=text,
-                        prompt_override=prompt_override,
-                    )
-                captions_cache[rel] = cap
-                logger.info("Captioned image: %s", img_path)
+            with quiet.quiet_stdio():
+                caps = caption_fn(images, prompts)
         except asyncio.CancelledError:
             raise
         except Exception as e:
-            logger.error("Failed to caption image %s: %s", img_path, e)
-            continue
+            if not retry_per_image:
+                logger.error("Batch captioning failed: %s", e)
+                continue
+            # NOTE:
+            # One bad image fails the whole batch; retry one by one
+            # so the remaining images still get captions.
+            logger.error("Batch captioning failed: %s; retrying per image", e)
+            caps = []
+            for (img_path, prompt, _), image in zip(chunk, images):
+                if cancel_evt and cancel_evt.is_set():
+                    raise asyncio.CancelledError()
+                try:
+                    with quiet.quiet_stdio():
+                        caps.extend(caption_fn([image], [prompt]))
+                except Exception as exc:
+                    logger.error("Failed to caption image %s: %s", img_path, exc)
+                    caps.append("")
+
+        for (img_path, _, key), cap in zip(chunk, caps):
+            if not cap:
+                continue
+            captions[img_path] = cap
+            if key is not None and caption_cache is not None:
+                caption_cache.set(key, cap)
+                for dup in duplicates.get(key, ()):
+                    captions[dup] = cap
+        logger.info("Captioned %d image(s)", len(chunk))
+
+    return captions
+
+def _rewrite_page(
+    page: _MarkdownPage,
+    captions: Dict[Path, str],
+    render: Callable[[str, str, str], str],
+) -> bool:
+    """
+    Rewrite a collected page in place with the generated captions.
+
+    Args:
+        page (_MarkdownPage): The collected page.
+        captions (Dict[Path, str]): Caption for each image path.
+        render (Callable[[str, str, str], str]): Renders (tag, alt, caption) into the replacement text.
 
-    # Replace tags with caption lines
-    def repl(m: re.Match) -> str:
-        alt = m.group(1)
-        rel = m.group(2)
-        cap = captions_cache.get(rel)
+    Returns:
+        bool: True if the file was modified, False otherwise.
+    """
+    # Resolve every tag's replacement up front so the substitution is a dict lookup
+    replacements: Dict[Tuple[str, str], str] = {}
+    for (alt, rel), tag in page.tags.items():
+        img_path = page.images.get(rel)
+        cap = captions.get(img_path) if img_path is not None else None
         if not cap:
-            return m.group(0)  # no change
-        if rewrite == CaptionRewrite.REPLACE:
-            return f"{(alt or 'Image').strip()} (Interpreted and captioned): {cap}"
-        # APPEND: keep original + caption
-        return f"{m.group(0)}{_render_caption_block(alt, cap)}"
-
-    new_text = _IMG_TAG.sub(repl, text)
-    if new_text != text:
-        md_file.write_text(new_text, encoding="utf-8")
-        logger.info("Captioned %s", md_file.name)
+            continue
+        replacements[(alt, rel)] = render(tag, alt, cap)
+    if not replacements:
+        return False
+
+    new_text = _IMG_TAG.sub(
+        lambda m: replacements.get((m.group(1), m.group(2)), m.group(0)),
+        page.text,
+    )
+    if new_text != page.text:
+        page.md_file.write_text(new_text, encoding="utf-8")
+        logger.info("Captioned %s", page.md_file.name)
         return True
-    return False 
+    return False
+
+def caption_markdown_files(
+    md_files: Iterable[Path],
+    captioner: DeepSeekVL2Captioner,
+    prompt_override: Optional[str] = None,
+    rewrite: CaptionRewrite = CaptionRewrite.APPEND,
+    cancel_evt: Optional[asyncio.Event] = None,
+    caption_cache: Optional[CaptionCache] = None,
+    batch_size: int = 32,
+    caption_fn: Optional[CaptionFn] = None,
+) -> int:
+    """
+    Caption the images of several Markdown files together and rewrite each file in place.
+    Images are gathered from every file first and deduplicated, then captioned in
+    shared batches, then every file is rewritten from the shared results.
+
+    Args:
+        md_files (Iterable[Path]): The markdown files to process.
+        captioner (DeepSeekVL2Captioner): The captioner instance to use for generating captions.
+        prompt_override (Optional[str]): Optional prompt to override the default captioning prompt.
+        rewrite (CaptionRewrite): Whether to append or replace captions in the markdown.
+        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
+        caption_cache (Optional[CaptionCache]): Optional persistent cache keyed by image content.
+        batch_size (int): Maximum number of images decoded and submitted per engine call.
+        caption_fn (Optional[CaptionFn]): Generates the captions instead of `captioner.caption_prompts`,
+                                          e.g. a batcher shared with other jobs. The captioner still
+                                          builds the prompts. It must isolate failures per image,
+                                          returning "" for images it could not caption; a batch it
+                                          raises on is not retried.
+
+    Returns:
+        int: Number of files that were modified.
+    """
+    # 1. Collect image tags from every file
+    pages: List[_MarkdownPage] = []
+    for md_file in md_files:
+        if cancel_evt and cancel_evt.is_set():
+            raise asyncio.CancelledError()
+        try:
+            page = _collect_page(md_file, captioner, prompt_override)
+        except Exception:
+            logger.exception("Failed to process %s", md_file.name)
+            continue
+        if page is not None:
+            pages.append(page)
+    if not pages:
+        return 0
+
+    # 2. Caption all unique images at once
+    captions = _caption_images(
+        pages,
+        caption_fn or captioner.caption_prompts,
+        prompt_override=prompt_override,
+        cancel_evt=cancel_evt,
+        caption_cache=caption_cache,
+        batch_size=batch_size,
+        retry_per_image=caption_fn is None,
+    )
+
+    # 3. Rewrite each file from the shared results
+    # NOTE: Pick the renderer once instead of branching on the mode per tag
+    render = _render_replace if rewrite == CaptionRewrite.REPLACE else _render_append
+    changed = 0
+    for page in pages:
+        try:
+            if _rewrite_page(page, captions, render):
+                changed += 1
+        except Exception:
+            logger.exception("Failed to process %s", page.md_file.name)
+    return changed
+
+def caption_markdown_file(
+    md_file: Path,
+    captioner: DeepSeekVL2Captioner,
+    prompt_override: Optional[str] = None,
+    rewrite: CaptionRewrite = CaptionRewrite.APPEND,
+    cancel_evt: Optional[asyncio.Event] = None,
+    caption_cache: Optional[CaptionCache] = None,
+) -> bool:
+    """
+    Read a single Markdown file, caption each image tag, and rewrite the file in place.
+    Returns True if the file changed, else False.
+
+    Args:
+        md_file (Path): The markdown file to process.
+        captioner (DeepSeekVL2Captioner): The captioner instance to use for generating captions.
+        prompt_override (Optional[str]): Optional prompt to override the default captioning prompt.
+        rewrite (CaptionRewrite): Whether to append or replace captions in the markdown.
+        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
+        caption_cache (Optional[CaptionCache]): Optional persistent cache keyed by image content.
+
+    Returns:
+        bool: True if the file was modified, False otherwise.
+    """
+    return caption_markdown_files(
+        [md_file],
+        captioner,
+        prompt_override=prompt_override,
+        rewrite=rewrite,
+        cancel_evt=cancel_evt,
+        caption_cache=caption_cache,
+    ) > 0
 
 def run_caption_pipeline(
     output_dir: Path,
@@ -140,6 +438,7 @@ def run_caption_pipeline(
     prompt: Optional[str] = None,
     rewrite: CaptionRewrite = CaptionRewrite.APPEND,
     cancel_evt: Optional[asyncio.Event] = None,
+    caption_cache: Optional[CaptionCache] = None,
 ) -> None:
     """
     For a finished OCR run (with images/ and markdown/), caption the images referenced
@@ -153,6 +452,7 @@ def run_caption_pipeline(
         prompt (Optional[str]): Optional prompt to override the default captioning prompt.
         rewrite (CaptionRewrite): Whether to append or replace captions in the markdown.
         cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
+        caption_cache (Optional[CaptionCache]): Optional persistent cache keyed by image content.
     """
     md_dir = output_dir / "markdown"
     if not md_dir.exists():
@@ -160,6 +460,7 @@ def run_caption_pipeline(
 
     if captioner is None:
         logger.info("Initializing captioner: %s", caption_model)
+        from .caption_engine import DeepSeekVL2Captioner, CaptionerConfig # heavy (vLLM)
         with quiet.quiet_stdio():
             captioner = DeepSeekVL2Captioner(
                 CaptionerConfig(
@@ -174,22 +475,16 @@ def run_caption_pipeline(
                 )
             )
 
-    changed = 0
-    for md_file in sorted(md_dir.glob("*.md")):
-        if cancel_evt and cancel_evt.is_set():
-            raise asyncio.CancelledError()
-
-        try:
-            if caption_markdown_file(
-                md_file, 
-                captioner, 
-                prompt_override=prompt, 
-                rewrite=rewrite, 
-                cancel_evt=cancel_evt):
-                changed += 1
-        except asyncio.CancelledError:
-            raise
-        except Exception:
-            logger.exception("Failed to process %s", md_file.name)
+    # NOTE:
+    # Images of all pages are captioned in shared batches rather than file by file,
+    # so pages with only one or two figures still keep the engine busy.
+    changed = caption_markdown_files(
+        sorted(md_dir.glob("*.md")),
+        captioner,
+        prompt_override=prompt,
+        rewrite=rewrite,
+        cancel_evt=cancel_evt,
+        caption_cache=caption_cache,
+    )
 
     logger.info("Caption pipeline finished. %d file(s) updated.", changed)
@@ -8,6 +8,12 @@ from pathlib import Path
 from typing import List
 from PIL import Image
 
+# NOTE:
+# zlib level 1 encodes several times faster than PIL's default (6) and the
+# files decode at least as fast when captioning; scanned crops barely shrink
+# at higher levels anyway.
+PNG_COMPRESS_LEVEL = 1
+
 # Matches only image / image_caption ref+det blocks
 _IMG_TAG = re.compile(
     r"<\|ref\|\>(image|image_caption)<\|/ref\|\><\|det\|\>(\[\[.*?\]\])<\|/det\|\>",
@@ -105,7 +111,7 @@ def rewrite_md_with_embeds(
                 crop = image.crop((x1, y1, x2, y2))
                 crop_name = f"{base_img_name}_img{img_counter:03d}.png"
                 crop_path = output_dir / crop_name
-                crop.save(crop_path)
+                crop.save(crop_path, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
 
                 md_snips.append(
                     f"![Image {img_counter}](./{assets_rel}/{crop_name})"
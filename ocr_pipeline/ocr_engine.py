@@ -1,13 +1,16 @@
 # ocr_pipeline/ocr_engine.py
 from __future__ import annotations
 
+import logging
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from vllm import LLM, SamplingParams
 from vllm.model_executor.models.deepseek_ocr import NGramPerReqLogitsProcessor
 from PIL import Image, ImageOps
 
+logger = logging.getLogger("pdfscribe2ds")
+
 class DeepSeekOCREngine:
     """
     Thin wrapper over vLLM-powered DeepSeek-OCR for single image to markdown inference.
@@ -16,14 +19,46 @@ class DeepSeekOCREngine:
         self,
         model_name: str = "deepseek-ai/DeepSeek-OCR",
         gpu_memory_utilization: float = 0.7,
+        quantization: Optional[str] = None,
     ) -> None:
         """
         Args:
             model_name (str): Name of the DeepSeek-OCR model.
             gpu_memory_utilization (float): Fraction of GPU memory to utilize.
+            quantization (Optional[str]): vLLM quantization method (e.g. "fp8"); None keeps the checkpoint's dtype.
         """
         self.model_name = model_name
-        self.llm = LLM(
+        try:
+            self.llm = self._load(model_name, gpu_memory_utilization, quantization)
+        except Exception as e:
+            if quantization is None:
+                raise
+            # Quantized weights unavailable for this model/GPU; fall back to full precision
+            logger.warning(
+                "Failed to load %s with quantization=%s (%s); falling back to unquantized weights",
+                model_name, quantization, e,
+            )
+            quantization = None
+            self.llm = self._load(model_name, gpu_memory_utilization, quantization)
+        self.quantization = quantization
+
+        # fixed prompt for now
+        self.prompt = "<image>\n<|grounding|>Convert the document to markdown."
+
+    @staticmethod
+    def _load(model_name: str, gpu_memory_utilization: float, quantization: Optional[str]) -> LLM:
+        """
+        Create the vLLM engine for DeepSeek-OCR.
+
+        Args:
+            model_name (str): Name of the DeepSeek-OCR model.
+            gpu_memory_utilization (float): Fraction of GPU memory to utilize.
+            quantization (Optional[str]): vLLM quantization method, or None.
+
+        Returns:
+            LLM: The loaded vLLM engine.
+        """
+        return LLM(
             model=model_name,
             enable_prefix_caching=False,
             mm_processor_cache_gb=0,
@@ -31,11 +66,9 @@ class DeepSeekOCREngine:
             # NOTE: Adjust GPU memory utilization as needed. Without this configuration,
             # there may be a memory(VRAM) allocation error on GPUs with limited memory (e.g., 16GB).
             gpu_memory_utilization=gpu_memory_utilization,
+            quantization=quantization,
         )
 
-        # fixed prompt for now
-        self.prompt = "<image>\n<|grounding|>Convert the document to markdown."
-
     def image_to_markdown(self, image_path: Path) -> str:
         """
         Run OCR on a single image file and return raw model text.
@@ -46,16 +79,59 @@ class DeepSeekOCREngine:
         Returns:
             str: OCR output in markdown format.
         """
-        image = ImageOps.exif_transpose(Image.open(image_path)).convert("RGB")
+        with Image.open(image_path) as img:
+            image = ImageOps.exif_transpose(img).convert("RGB")
+        return self.image_to_markdown_from_image(image)
+
+    def image_to_markdown_from_image(self, image: Image.Image) -> str:
+        """
+        Run OCR on an already decoded image and return raw model text.
+        Lets callers that need the pixels anyway decode the page only once.
+
+        Args:
+            image (Image.Image): The input page image.
+
+        Returns:
+            str: OCR output in markdown format.
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
 
         model_input: Dict[str, Any] = {
             "prompt": self.prompt,
             "multi_modal_data": {"image": image},
         }
 
-        sampling_param = SamplingParams(
+        outputs = self.llm.generate(model_input, self._sampling_params(), use_tqdm=False)  # type: ignore
+        text_output = outputs[0].outputs[0].text
+        return text_output
+
+    def warmup(self) -> None:
+        """
+        Run OCR on a blank page with a short generation budget so one-time costs
+        (multimodal processor setup, kernel selection, CUDA graph capture) are
+        paid at startup instead of by the first request.
+        """
+        model_input: Dict[str, Any] = {
+            "prompt": self.prompt,
+            "multi_modal_data": {"image": Image.new("RGB", (1024, 1024), "white")},
+        }
+        self.llm.generate(model_input, self._sampling_params(max_tokens=8), use_tqdm=False)  # type: ignore
+
+    @staticmethod
+    def _sampling_params(max_tokens: int = 8192) -> SamplingParams:
+        """
+        Sampling parameters for OCR generation.
+
+        Args:
+            max_tokens (int): Generation budget per page.
+
+        Returns:
+            SamplingParams: Greedy sampling with the n-gram repetition guard.
+        """
+        return SamplingParams(
             temperature=0.0,
-            max_tokens=8192,
+            max_tokens=max_tokens,
             extra_args=dict(
                 ngram_size=30,
                 window_size=90,
@@ -64,7 +140,3 @@ class DeepSeekOCREngine:
             skip_special_tokens=False,
         )
 
-        outputs = self.llm.generate(model_input, sampling_param, use_tqdm=False)  # type: ignore
-        text_output = outputs[0].outputs[0].text
-        return text_output
-
@@ -2,145 +2,134 @@
 from __future__ import annotations
 
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterator, Tuple
 
-from pdf2image import convert_from_path, pdfinfo_from_path
+import pymupdf
+from PIL import Image
 
-def _page_ranges(total_pages: int, num_chunks: int) -> List[Tuple[int, int]]:
+_RENDER_DONE = "done" # end-of-document marker for the render queue
+_RENDER_ERROR = "error" # followed by the error message
+
+def pdf_page_count(pdf_path: Path) -> int:
     """
-    Divide total pages into num_chunks ranges.
+    Count the pages of a PDF without rendering anything.
 
     Args:
-        total_pages (int): Total number of pages in the PDF
-        num_chunks (int): Number of chunks to divide into
+        pdf_path (Path): Path to the PDF file.
 
     Returns:
-        List[Tuple[int, int]]: List of (start_page, end_page) tuples
+        int: Number of pages.
+
+    Raises:
+        RuntimeError: If the file cannot be parsed as a PDF (raised by PyMuPDF).
     """
-    num_chunks = max(1, min(num_chunks, total_pages))
-    base, rem = divmod(total_pages, num_chunks)
-    ranges = []
-    start = 1
-    for i in range(num_chunks):
-        size = base + (1 if i < rem else 0)
-        end = start + size - 1
-        ranges.append((start, end))
-        start = end + 1
-    return ranges
-
-def _convert_page_range(
-    pdf_path: str,
-    start_page: int,
-    end_page: int,
-    dpi: int,
-    thread_count: int
-) -> List:
+    with pymupdf.open(str(pdf_path), filetype="pdf") as doc:
+        return doc.page_count
+
+def _put_unless_stopped(q, item, stop) -> bool:
     """
-    Convert a specific range of PDF pages to images.
+    Put an item on a bounded queue, giving up once the consumer has stopped.
 
     Args:
-        pdf_path (str): Path to the PDF file
-        start_page (int): Starting page number (1-indexed)
-        end_page (int): Ending page number (1-indexed)
-        dpi (int): DPI for conversion
-        thread_count (int): Number of threads for pdf2image
+        q (multiprocessing.Queue): The target queue.
+        item: The item to put.
+        stop (multiprocessing.Event): Set by the consumer when it no longer reads.
 
     Returns:
-        List: List of PIL images for the page range
+        bool: True if the item was queued, False if the consumer stopped.
     """
-    return convert_from_path(
-        pdf_path,
-        dpi=dpi,
-        first_page=start_page,
-        last_page=end_page,
-        thread_count=thread_count
-    )
-
-def _save_image(args):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _render_pages(pdf_path: str, dpi: int, q, stop) -> None:
     """
-    Save a single image to disk.
+    Render process body: render every page and send its raw RGB samples to the parent.
 
     Args:
-        args: Tuple of (page_image, img_path, format)
+        pdf_path (str): Path to the input PDF file.
+        dpi (int): Dots per inch for image quality.
+        q (multiprocessing.Queue): Bounded queue of (page number, width, height, samples) items.
+        stop (multiprocessing.Event): Set by the parent when it no longer reads.
     """
-    page, img_path, format = args
-    page.save(img_path, format=format.upper())
-    return img_path
-
-def pdf_to_images(
+    try:
+        with pymupdf.open(pdf_path) as doc:
+            matrix = pymupdf.Matrix(dpi / 72.0, dpi / 72.0)
+            for page_no, page in enumerate(doc, start=1):
+                pix = page.get_pixmap(matrix=matrix, alpha=False)
+                if not _put_unless_stopped(q, (page_no, pix.width, pix.height, pix.samples), stop):
+                    break
+            else:
+                _put_unless_stopped(q, _RENDER_DONE, stop)
+    except Exception as e:
+        _put_unless_stopped(q, (_RENDER_ERROR, f"{type(e).__name__}: {e}"), stop)
+    if stop.is_set():
+        # Nobody drains the queue anymore; don't block exit on flushing it
+        q.cancel_join_thread()
+
+def pdf_to_image_iter(
     pdf_path: Path,
-    out_dir: Path,
     dpi: int = 200,
-    format: str = "png",
-    num_processes: int | None = None,
-    num_threads: int | None = None
-) -> List[Path]:
+    prefetch: int = 4,
+) -> Iterator[Tuple[int, Image.Image]]:
     """
-    Convert a PDF into a list of image files (one per page) using parallelism.
+    Render a PDF page by page into in-memory RGB images with PyMuPDF and yield
+    them in page order. Rendering runs in a separate process up to `prefetch`
+    pages ahead, so it overlaps with whatever the caller does with earlier pages
+    (e.g. OCR). No intermediate image file is encoded or decoded.
 
     Args:
         pdf_path (Path): Path to the input PDF file.
-        out_dir (Path): Directory to save the output images.
         dpi (int, optional): Dots per inch for image quality. Defaults to 200.
-        format (str, optional): Image format (e.g., 'png', 'jpeg'). Defaults to 'png'.
-        num_processes (int, optional): Number of processes for parallel page conversion. 
-                                      Defaults to CPU count // 2.
-        num_threads (int, optional): Number of threads for parallel image saving.
-                                    Defaults to 4.
+        prefetch (int, optional): Maximum number of pages rendered ahead of the consumer.
+                                  Defaults to 4.
 
-    Returns:
-        List[Path]: List of paths to the generated image files.
+    Yields:
+        Tuple[int, Image.Image]: (page number starting at 1, page image).
+
+    Raises:
+        RuntimeError: If rendering fails or the render process dies.
     """
-    out_dir.mkdir(parents=True, exist_ok=True)
-    
-    if num_processes is None:
-        num_processes = max(1, multiprocessing.cpu_count() // 2)
-    if num_threads is None:
-        num_threads = 4
-    
-    # First, get total number of pages
-    info = pdfinfo_from_path(str(pdf_path))
-    total_pages = info["Pages"]
-    
-    if total_pages == 0:
-        return []
-    
-    page_ranges = _page_ranges(total_pages, num_processes)
-
-    # Convert page ranges in parallel using multiprocessing
-    with multiprocessing.Pool(processes=len(page_ranges)) as pool:
-        results = pool.starmap(
-            _convert_page_range,
-            [(str(pdf_path), start, end, dpi, 2) for start, end in page_ranges]
-        )
-
-    # Flatten the results
-    all_pages = []
-    for result in results:
-        all_pages.extend(result)
-
-    # Prepare save tasks
-    save_tasks = []
-    for idx, page in enumerate(all_pages, start=1):
-        img_name = f"page-{idx:03d}.{format}"
-        img_path = out_dir / img_name
-        save_tasks.append((page, img_path, format))
-
-    # Save images in parallel using threading
-    image_paths = []
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        future_to_task = {
-            executor.submit(_save_image, task): task for task in save_tasks
-        }
-
-        # Collect results as they complete
-        for future in as_completed(future_to_task):
-            img_path = future.result()
-            image_paths.append(img_path)
-
-    # Sort by page number to maintain order
-    image_paths.sort(key=lambda x: int(x.stem.split('-')[1]))
-
-    return image_paths
+    # NOTE:
+    # PyMuPDF holds the GIL while rasterizing and does not support threads, so
+    # rendering in-process would stall the event loop for every page. A spawned
+    # process (never fork: the parent holds CUDA and vLLM state) ships the raw
+    # pixmap bytes instead.
+    ctx = multiprocessing.get_context("spawn")
+    q = ctx.Queue(maxsize=max(1, prefetch))
+    stop = ctx.Event()
+    renderer = ctx.Process(
+        target=_render_pages,
+        args=(str(pdf_path), dpi, q, stop),
+        name="pdf-render",
+        daemon=True,
+    )
+    renderer.start()
+    try:
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                if not renderer.is_alive():
+                    raise RuntimeError(f"PDF render process exited unexpectedly (exit code {renderer.exitcode})")
+                continue
+            if item == _RENDER_DONE:
+                return
+            if item[0] == _RENDER_ERROR:
+                raise RuntimeError(f"Failed to render {pdf_path.name}: {item[1]}")
+            page_no, width, height, samples = item
+            yield page_no, Image.frombytes("RGB", (width, height), samples)
+    finally:
+        # Consumer finished or bailed out early: let the renderer exit
+        stop.set()
+        renderer.join(timeout=5)
+        if renderer.is_alive():
+            renderer.terminate()
+            renderer.join()
+        q.close()
@@ -1,20 +1,22 @@
 # ocr_pipeline/pipeline.py
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import TYPE_CHECKING, Callable, List, Optional
 from pathlib import Path
 from typing import List, Optional
 import logging
 import asyncio
-
-from PIL import Image
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
 
 from .config import PipelineConfig
-from .pdf_loader import pdf_to_images
-from .ocr_engine import DeepSeekOCREngine
-from .md_rewriter import rewrite_md_with_embeds
+from .pdf_loader import pdf_to_image_iter
+from .md_rewriter import PNG_COMPRESS_LEVEL, rewrite_md_with_embeds
 import quiet
 
+if TYPE_CHECKING:
+    from .ocr_engine import DeepSeekOCREngine
+
 logger = logging.getLogger("pdfscribe2ds")
 
 def run_pdf_pipeline(
@@ -26,19 +28,24 @@ def run_pdf_pipeline(
     num_threads: Optional[int] = None,
     ocr_engine: Optional[DeepSeekOCREngine] = None,
     cancel_evt: Optional[asyncio.Event] = None,
+    on_page: Optional[Callable[[Path], None]] = None,
 ) -> None:
     """
     Full PDF -> images -> DeepSeek-OCR -> Markdown pipeline.
+    Pages are rendered in memory and fed to OCR directly; page images are
+    also written to images/ for the output.
 
     Args:
         pdf_path (Path): Path to the input PDF file.
         output_dir (Path): Directory to save output images and markdown files.
         model_name (str): Name of the DeepSeek-OCR model to use.
         dpi (int): Dots per inch for image quality when converting PDF to images.
-        num_processes (int, optional): Number of processes for parallel PDF conversion.
-        num_threads (int, optional): Number of threads for parallel image saving.
+        num_processes (int, optional): Unused; kept for backward compatibility.
+        num_threads (int, optional): Number of threads encoding page images to disk.
         ocr_engine (DeepSeekOCREngine, optional): Pre-initialized OCR engine to reuse.
         cancel_evt (asyncio.Event, optional): Event to signal cancellation.
+        on_page (Callable[[Path], None], optional): Called with each Markdown file as soon as
+                                                    it is written, e.g. to start captioning it.
     """
     cfg = PipelineConfig(
         pdf_path=pdf_path,
@@ -47,67 +54,76 @@ def run_pdf_pipeline(
         dpi=dpi,
     )
 
-    # 1. PDF -> images/{page-001.png, ...}
-    images_out_dir = cfg.output_dir / "images"
-    logger.info(f"Converting PDF to images in {images_out_dir}...")
-    image_paths: List[Path] = pdf_to_images(
-        pdf_path=cfg.pdf_path,
-        out_dir=images_out_dir,
-        dpi=cfg.dpi,
-        num_processes=num_processes,
-        num_threads=num_threads,
-    )
-    logger.info("Converted %d pages to images at %s", len(image_paths), images_out_dir)
-
-    # Check for cancellation
-    if cancel_evt and cancel_evt.is_set():
-        raise asyncio.CancelledError()
-
-    # 2. Prepare OCR engine
+    # 1. Prepare OCR engine
     if ocr_engine is not None:
         ocr = ocr_engine
     else:
+        from .ocr_engine import DeepSeekOCREngine # heavy (vLLM); only needed without a preloaded engine
         with quiet.quiet_stdio():
             ocr = DeepSeekOCREngine(model_name=cfg.model_name)
 
+    # 2. PDF -> in-memory page images, rendered in the background
+    #    while earlier pages go through OCR
+    images_out_dir = cfg.output_dir / "images"
+    images_out_dir.mkdir(parents=True, exist_ok=True)
+    pages = pdf_to_image_iter(pdf_path=cfg.pdf_path, dpi=cfg.dpi)
+
     # 3. Per page processing
     md_out_dir = cfg.output_dir / "markdown"
     md_out_dir.mkdir(parents=True, exist_ok=True)
 
-    for img_path in image_paths:
-        # Check for cancellation
-        if cancel_evt and cancel_evt.is_set():
-            raise asyncio.CancelledError()
-
-        # OCR image -> raw markdown
-        # Rewrite markdown with embedded images
-        # Save final markdown file
-        try:
-            with quiet.quiet_stdio():
-                raw_md = ocr.image_to_markdown(img_path)
-
-            page_stem = img_path.stem  # e.g. "page_001"
-            assets_dir = md_out_dir / f"{page_stem}_assets"
-
-            # ensure file handle closes immediately
-            with Image.open(img_path) as _img:
-                img = _img.convert("RGB")
-
-            # re-open image to pass to rewriter
-            cleaned_md = rewrite_md_with_embeds(
-                text_output=raw_md,
-                image=img,
-                output_dir=assets_dir,
-                base_img_name=page_stem,
-            )
-
-            md_file = md_out_dir / f"{page_stem}.md"
-            md_file.write_text(cleaned_md, encoding="utf-8")
-
-            logger.info(f"[OK] page {page_stem} --> {md_file}")
-        except asyncio.CancelledError:
-            raise
-        except Exception:
-            logger.exception("Failed to process %s; skipping.", img_path.name)
+    # NOTE:
+    # Page PNGs (images/{page-001.png, ...}) are only shipped in the output,
+    # nothing reads them back; encode them on side threads off the OCR path.
+    # closing() stops background rendering if we bail out early.
+    saves: List[Future] = []
+    with closing(pages), ThreadPoolExecutor(
+        max_workers=num_threads or 2, thread_name_prefix="page-png"
+    ) as saver:
+        for page_no, img in pages:
+            # Check for cancellation
+            if cancel_evt and cancel_evt.is_set():
+                raise asyncio.CancelledError()
+
+            page_stem = f"page-{page_no:03d}"
+            saves.append(saver.submit(
+                img.save,
+                images_out_dir / f"{page_stem}.png",
+                format="PNG",
+                compress_level=PNG_COMPRESS_LEVEL,
+            ))
+
+            # OCR image -> raw markdown
+            # Rewrite markdown with embedded images
+            # Save final markdown file
+            try:
+                with quiet.quiet_stdio():
+                    raw_md = ocr.image_to_markdown_from_image(img)
+
+                assets_dir = md_out_dir / f"{page_stem}_assets"
+
+                # The rendered page is shared between OCR and the rewriter
+                cleaned_md = rewrite_md_with_embeds(
+                    text_output=raw_md,
+                    image=img,
+                    output_dir=assets_dir,
+                    base_img_name=page_stem,
+                )
+
+                md_file = md_out_dir / f"{page_stem}.md"
+                md_file.write_text(cleaned_md, encoding="utf-8")
+
+                logger.info(f"[OK] page {page_stem} --> {md_file}")
+                if on_page is not None:
+                    on_page(md_file)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to process %s; skipping.", page_stem)
+
+    for fut in saves:
+        if fut.exception() is not None:
+            logger.error("Failed to save page image: %s", fut.exception())
+    logger.info("Processed %d page(s) into %s", len(saves), md_out_dir)
 
     logger.info(f"Pipeline finished for {pdf_path} --> {cfg.output_dir}")
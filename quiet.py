@@ -1,5 +1,7 @@
 # quiet.py
 import os
+import sys
+import threading
 import warnings
 import logging
 import contextlib
@@ -26,11 +28,38 @@ def apply_library_quiet_logging() -> None:
     """
     Set logging levels for various libraries to ERROR to suppress verbose output.
     """
-    for name in ("vllm", "transformers", "torch", "torch.distributed", "PIL", "pdf2image"):
+    for name in ("vllm", "transformers", "torch", "torch.distributed", "PIL"):
         logging.getLogger(name).setLevel(logging.ERROR)
 
+# NOTE:
+# sys.stdout/sys.stderr are process-wide, and OCR and captioning call into
+# quiet_stdio() from different threads at the same time. All users share one
+# redirection: the first entry swaps the streams, the last exit restores them.
+_quiet_lock = threading.Lock()
+_quiet_depth = 0
+_saved_stdio = None # (stdout, stderr, devnull) while redirected
+
 @contextlib.contextmanager
 def quiet_stdio():
+    """
+    Silence stdout/stderr while noisy library code runs.
+    Safe to nest and to use from several threads at once.
+    """
+    global _quiet_depth, _saved_stdio
     apply_library_quiet_logging()
-    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+    with _quiet_lock:
+        if _quiet_depth == 0:
+            devnull = open(os.devnull, "w")
+            _saved_stdio = (sys.stdout, sys.stderr, devnull)
+            sys.stdout = sys.stderr = devnull
+        _quiet_depth += 1
+    try:
         yield
+    finally:
+        with _quiet_lock:
+            _quiet_depth -= 1
+            if _quiet_depth == 0:
+                stdout, stderr, devnull = _saved_stdio
+                sys.stdout, sys.stderr = stdout, stderr
+                _saved_stdio = None
+                devnull.close()
@@ -0,0 +1,251 @@
+# service/caption_batcher.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence, Set
+
+if TYPE_CHECKING:
+    from PIL import Image
+    from caption_pipeline.caption_engine import DeepSeekVL2Captioner
+
+logger = logging.getLogger("pdfscribe2ds")
+
+@dataclass
+class _CaptionRequest:
+    image: Image.Image
+    prompt: str
+    future: asyncio.Future
+
+class CaptionBatcher:
+    """
+    Server-wide micro-batcher in front of the VL2 engine. Caption requests of
+    all running jobs are collected for up to `max_wait_ms` (or until `max_batch`
+    are queued) and generated in a single engine call, so concurrent jobs share
+    batches instead of taking turns with small ones. With several captioner
+    replicas, one batch runs on each replica at a time.
+    """
+    def __init__(
+        self,
+        captioners: Sequence[DeepSeekVL2Captioner],
+        max_batch: int = 16,
+        max_wait_ms: float = 15.0,
+        thread_initializer: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Args:
+            captioners (Sequence[DeepSeekVL2Captioner]): The loaded VL2 captioner replicas.
+            max_batch (int): Maximum number of images per engine call.
+            max_wait_ms (float): How long to wait for more requests before submitting a partial batch.
+            thread_initializer (Optional[Callable[[], None]]): Run once in each engine-call thread, e.g. CPU pinning.
+        """
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000.0
+
+        self._queue: asyncio.Queue[_CaptionRequest] = asyncio.Queue()
+        # NOTE:
+        # A replica is taken only once a batch is ready, so an idle batcher
+        # holds none; while all of them are busy, requests keep queueing and
+        # are added to the waiting batch, which makes it a fuller one.
+        self._idle: asyncio.Queue[DeepSeekVL2Captioner] = asyncio.Queue()
+        for captioner in captioners:
+            self._idle.put_nowait(captioner)
+        # NOTE:
+        # Dedicated threads for engine calls; job threads block on results
+        # in the caption executor and must not starve the batcher of a worker.
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(captioners),
+            thread_name_prefix="vl2-batch",
+            initializer=thread_initializer,
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    @property
+    def busy(self) -> bool:
+        """
+        Whether every replica is running a batch.
+        """
+        return self._idle.empty()
+
+    def start(self) -> None:
+        """
+        Start the batching task on the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    def stop(self) -> None:
+        """
+        Stop the batching task and its engine thread.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        for task in self._inflight:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, image: Image.Image, prompt: str) -> str:
+        """
+        Queue one image for captioning and wait for its caption.
+
+        Args:
+            image (Image.Image): The image to caption.
+            prompt (str): Its prebuilt prompt (see `DeepSeekVL2Captioner.build_prompt`).
+
+        Returns:
+            str: The generated caption text.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_CaptionRequest(image, prompt, future))
+        return await future
+
+    async def _submit_many(self, images: Sequence[Image.Image], prompts: Sequence[str]) -> List[str]:
+        """
+        Submit several images at once; they may land in different batches.
+        An image that fails gets an empty caption instead of failing the others.
+        """
+        results = await asyncio.gather(
+            *(self.submit(i, p) for i, p in zip(images, prompts)),
+            return_exceptions=True,
+        )
+        captions: List[str] = []
+        for n, result in enumerate(results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                logger.error("Failed to caption image %d of %d: %s", n + 1, len(results), result)
+                captions.append("")
+            else:
+                captions.append(result)
+        return captions
+
+    def caption_prompts(self, images: Sequence[Image.Image], prompts: Sequence[str]) -> List[str]:
+        """
+        Blocking counterpart of `submit` for worker threads, with the same
+        signature as `DeepSeekVL2Captioner.caption_prompts`.
+        Must not be called from the event loop thread.
+        Failures are isolated per image: a failed image gets an empty caption.
+
+        Args:
+            images (Sequence[Image.Image]): The images to caption.
+            prompts (Sequence[str]): The prompt for each image.
+
+        Returns:
+            List[str]: The generated caption texts, in the same order as `images`;
+                       "" for images that failed.
+        """
+        if len(images) != len(prompts):
+            raise ValueError(f"Got {len(images)} image(s) but {len(prompts)} prompt(s)")
+        if not images:
+            return []
+        if self._loop is None:
+            raise RuntimeError("Caption batcher is not started yet.")
+        return asyncio.run_coroutine_threadsafe(self._submit_many(images, prompts), self._loop).result()
+
+    async def _next_batch(self) -> List[_CaptionRequest]:
+        """
+        Wait for at least one request, then briefly for more, up to `max_batch`.
+
+        Returns:
+            List[_CaptionRequest]: The requests whose callers are still waiting.
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return [r for r in batch if not r.future.done()]
+
+    async def _run(self) -> None:
+        """
+        Batching loop: collect a batch, take an idle replica, hand both to a generation task.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                captioner = await self._idle.get()
+            except asyncio.CancelledError:
+                for r in batch:
+                    r.future.cancel()
+                raise
+            # Top up with what queued while every replica was busy.
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            batch = [r for r in batch if not r.future.done()]
+            if not batch:
+                self._idle.put_nowait(captioner)
+                continue
+
+            task = loop.create_task(self._generate(captioner, batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _generate(self, captioner: DeepSeekVL2Captioner, batch: List[_CaptionRequest]) -> None:
+        """
+        Run one engine call on the given replica and resolve the callers.
+        If a shared batch fails, its requests are retried one by one here, so
+        one job's bad image never fails the captions of the jobs batched with it.
+
+        Args:
+            captioner (DeepSeekVL2Captioner): The rented replica; returned when done.
+            batch (List[_CaptionRequest]): The requests to caption.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def _call(reqs: List[_CaptionRequest]) -> List[str]:
+            return await loop.run_in_executor(
+                self._executor,
+                captioner.caption_prompts,
+                [r.image for r in reqs],
+                [r.prompt for r in reqs],
+            )
+
+        try:
+            try:
+                captions = await _call(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if len(batch) == 1:
+                    raise
+                logger.error("Batched captioning of %d image(s) failed: %s; retrying per image", len(batch), e)
+                for r in batch:
+                    if r.future.done():
+                        continue
+                    try:
+                        r.future.set_result((await _call([r]))[0])
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as exc:
+                        if not r.future.done():
+                            r.future.set_exception(exc)
+            else:
+                for r, caption in zip(batch, captions):
+                    if not r.future.done():
+                        r.future.set_result(caption)
+        except asyncio.CancelledError:
+            for r in batch:
+                r.future.cancel()
+            raise
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+        finally:
+            self._idle.put_nowait(captioner)
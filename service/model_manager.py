@@ -3,37 +3,163 @@ from __future__ import annotations
 
 import os
 import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional, Set
 from contextlib import contextmanager
 
 import quiet
-from ocr_pipeline.ocr_engine import DeepSeekOCREngine
-from caption_pipeline.caption_engine import DeepSeekVL2Captioner, CaptionerConfig
+from caption_pipeline.caption_cache import CaptionCache
+from service.caption_batcher import CaptionBatcher
+from service.numa import numa_local_cpus, pin_current_thread
+from service.workers import TMP_ROOT, ScratchPool, prepare_tmp_root
+
+# NOTE:
+# The engine modules pull in vLLM, torch and CUDA. They are imported inside
+# init_engines so that merely importing the service (tooling, health-only
+# processes) stays cheap.
+if TYPE_CHECKING:
+    from ocr_pipeline.ocr_engine import DeepSeekOCREngine
+    from caption_pipeline.caption_engine import DeepSeekVL2Captioner
+
+logger = logging.getLogger("pdfscribe2ds")
+
+# NOTE:
+# vLLM starts each engine core in a child process that picks its GPU from the
+# inherited CUDA_VISIBLE_DEVICES; there is no per-engine device argument to use
+# instead. The variable is process-global, so every pinned section is serialized.
+_cuda_env_lock = threading.Lock()
 
 @contextmanager
-def _with_cuda_visible(dev_ids: str):
+def _with_cuda_visible(dev_ids: str, extra_env: Optional[Dict[str, str]] = None):
     """
     Temporarily set CUDA_VISIBLE_DEVICE for engine initialization.
+    Holds a process-wide lock for the duration, so concurrent callers
+    never observe or spawn engines under each other's device list.
 
     Args:
         dev_ids (str): Comma-separated GPU device IDs to set.
+        extra_env (Optional[Dict[str, str]]): Further variables the engine processes should inherit.
     """
-    old = os.environ.get("CUDA_VISIBLE_DEVICES")
-    os.environ["CUDA_VISIBLE_DEVICES"] = dev_ids
-    try:
-        yield
-    finally:
-        if old is None:
-            os.environ.pop("CUDA_VISIBLE_DEVICES", None)
-        else:
-            os.environ["CUDA_VISIBLE_DEVICES"] = old
+    env = {"CUDA_VISIBLE_DEVICES": dev_ids, **(extra_env or {})}
+    with _cuda_env_lock:
+        old = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            yield
+        finally:
+            for name, value in old.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+def shared_gpus(ocr_device: str, vl2_device: str) -> Set[str]:
+    """
+    GPU device IDs that both engines are pinned to.
+
+    Args:
+        ocr_device (str): CUDA device ID(s) of the OCR model.
+        vl2_device (str): CUDA device ID(s) of the VL2 model.
+
+    Returns:
+        Set[str]: The shared device IDs; empty if the engines use separate GPUs.
+    """
+    return {d.strip() for d in ocr_device.split(",")} & {d.strip() for d in vl2_device.split(",")}
+
+# NOTE: Headroom vLLM needs outside its own budget (CUDA context, activations)
+_SHARED_GPU_MEM_LIMIT = 0.95
+
+def _check_shared_device(
+    ocr_device: str,
+    vl2_device: str,
+    gpu_mem_ocr: float,
+    gpu_mem_vl2: float,
+) -> None:
+    """
+    Validate the memory split when OCR and VL2 share a GPU.
+    Both engines run in their own vLLM engine processes, i.e. separate CUDA
+    contexts, which the GPU time-slices unless CUDA MPS is in use. Either way
+    both are resident at once, so their memory budgets must fit side by side.
+
+    Args:
+        ocr_device (str): CUDA device ID(s) of the OCR model.
+        vl2_device (str): CUDA device ID(s) of the VL2 model.
+        gpu_mem_ocr (float): Fraction of GPU memory for the OCR model.
+        gpu_mem_vl2 (float): Fraction of GPU memory for the VL2 model.
+
+    Raises:
+        ValueError: If both engines share a device and their budgets exceed it.
+    """
+    shared = shared_gpus(ocr_device, vl2_device)
+    if shared and gpu_mem_ocr + gpu_mem_vl2 > _SHARED_GPU_MEM_LIMIT:
+        raise ValueError(
+            f"OCR and VL2 share GPU {','.join(sorted(shared))} but request "
+            f"{gpu_mem_ocr:.2f} + {gpu_mem_vl2:.2f} of its memory; "
+            f"lower GPU_MEM_OCR/GPU_MEM_VL2 to a total of at most {_SHARED_GPU_MEM_LIMIT:.2f}"
+        )
 
 @dataclass
 class Engines:
-    ocr: DeepSeekOCREngine
-    vl2: DeepSeekVL2Captioner
+    ocr: DeepSeekOCREngine # first OCR replica; model metadata
+    vl2: DeepSeekVL2Captioner # first VL2 replica; model metadata and prompt building
     gate: asyncio.BoundedSemaphore # admission gate for GPU work
+    # NOTE:
+    # Idle OCR replicas. A job rents one only while it is in the OCR stage, so
+    # with gpu_slots > 1 one job's OCR overlaps another job's captioning, and
+    # with several replicas several jobs are OCR'd at once.
+    ocr_pool: asyncio.Queue[DeepSeekOCREngine]
+    # NOTE:
+    # Captioning needs no gate: every job's images go through this one batcher,
+    # which merges concurrent jobs into shared calls on its VL2 replicas.
+    caption_batcher: CaptionBatcher
+    # NOTE:
+    # Threads that run the blocking job stages, one pool per model so each can
+    # be pinned to its own GPU's NUMA node. An admitted job uses at most one
+    # thread of each at once, so gpu_slots workers apiece never queue admitted
+    # work while keeping bursts from spawning idle threads.
+    ocr_executor: ThreadPoolExecutor # OCR stage: page rendering, OCR calls, page output
+    caption_executor: ThreadPoolExecutor # caption stage: image decoding, batcher round trips
+    # NOTE:
+    # Reused work directories. A job's directory outlives its admission slot
+    # (zipping, sending the response), hence twice as many as gpu_slots.
+    scratch: ScratchPool
+    caption_cache: Optional[CaptionCache] = None # persistent caption store (opt-in)
+    gpu_slots: int = 1 # capacity of the admission gate
+    # NOTE:
+    # Jobs currently holding an admission slot. Only touched from the event loop
+    # thread and never across an await, so no extra lock is needed.
+    in_flight: int = 0
+
+class AdmissionSlot:
+    """
+    A slot acquired on the GPU admission gate. The holder keeps it for the whole
+    job and it is released exactly once, on context exit or via `release()`.
+    Creating a slot counts the job as in flight; releasing it uncounts it.
+    """
+    def __init__(self, engines: Engines) -> None:
+        self._engines = engines
+        self._released = False
+        engines.in_flight += 1
+
+    def release(self) -> None:
+        """
+        Give the slot back to the gate. Subsequent calls are no-ops.
+        """
+        if not self._released:
+            self._released = True
+            self._engines.in_flight -= 1
+            self._engines.gate.release()
+
+    async def __aenter__(self) -> AdmissionSlot:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
 
 _engines: Optional[Engines] = None
 
@@ -45,50 +171,188 @@ def init_engines(
     seed: int | None,
     gpu_slots: int = 1,
     *,
+    ocr_replicas: int = 1,
+    vl2_replicas: int = 1,
     ocr_device: str = "0",
     vl2_device: str = "0",
+    vl2_max_num_seqs: int = 8,
+    vl2_mm_cache_gb: float = 4.0,
+    enable_prefix_caching: bool = True,
+    vl2_quantization: str | None = None,
+    ocr_quantization: str | None = None,
+    caption_cache_dir: str | None = None,
+    warmup: bool = True,
+    work_root: str | None = None,
+    caption_batch_max: int = 16,
+    caption_batch_wait_ms: float = 15.0,
+    mps_thread_percentage: int | None = None,
+    pin_numa: bool = False,
 ) -> None:
     """
     Initialize and warm the engines once per process.
+    Must be called from the service's event loop, which runs the caption batcher.
 
     Args:
         ocr_model (str): Name of the OCR model to load.
         vl2_model (str): Name of the Vision Language Model to load.
-        gpu_mem_ocr (float): Fraction of GPU memory to allocate for OCR model.
-        gpu_mem_vl2 (float): Fraction of GPU memory to allocate for VL2 model.
+        gpu_mem_ocr (float): Fraction of GPU memory to allocate for OCR model, split across its replicas.
+        gpu_mem_vl2 (float): Fraction of GPU memory to allocate for VL2 model, split across its replicas.
         seed (int | None): Random seed for model initialization.
         gpu_slots (int): Number of concurrent GPU jobs allowed.
+        ocr_replicas (int): Number of OCR engine instances; also the number of jobs OCR'd at once.
+        vl2_replicas (int): Number of VL2 engine instances; also the number of caption batches run at once.
+        ocr_device (str): CUDA device ID(s) to pin the OCR model to.
+        vl2_device (str): CUDA device ID(s) to pin the VL2 model to.
+        vl2_max_num_seqs (int): Maximum number of images the VL2 engine batches at once.
+        vl2_mm_cache_gb (float): Size of the VL2 processed-image cache in GiB (0 disables it).
+        enable_prefix_caching (bool): Whether the VL2 engine reuses KV cache of shared prompt prefixes.
+        vl2_quantization (str | None): vLLM quantization method for the VL2 model; None for full precision.
+        ocr_quantization (str | None): vLLM quantization method for the OCR model; None for full precision.
+        caption_cache_dir (str | None): Directory for the persistent caption cache; None disables it.
+        warmup (bool): Run one tiny OCR and caption pass before serving requests.
+        work_root (str | None): Work root from `prepare_tmp_root` holding the pooled job directories;
+                                None to prepare one under the default TMP_ROOT.
+        caption_batch_max (int): Maximum number of images, across all jobs, per VL2 engine call.
+        caption_batch_wait_ms (float): How long the caption batcher waits to fill a batch.
+        mps_thread_percentage (int | None): Share of the GPU's SMs each engine may use under CUDA MPS;
+                                            None when MPS is not in use.
+        pin_numa (bool): Pin the OCR and VL2 worker threads to CPUs on their GPU's NUMA node.
     """
-    global _engines
     if _engines is not None:
         return
 
+    _check_shared_device(ocr_device, vl2_device, gpu_mem_ocr, gpu_mem_vl2)
+
+    from ocr_pipeline.ocr_engine import DeepSeekOCREngine
+    from caption_pipeline.caption_engine import DeepSeekVL2Captioner, CaptionerConfig
+
+    # NOTE:
+    # Each replica is a separate vLLM engine with its own weights and KV cache.
+    # The configured memory fraction is the budget of all replicas together.
+    # NOTE: Inherited by the engine processes; caps each engine's SM share on a shared GPU
+    mps_env = (
+        {"CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": str(mps_thread_percentage)}
+        if mps_thread_percentage is not None else None
+    )
     with quiet.quiet_stdio():
         # OCR model (Pinning OCR model to GPU0 or choiced device)
-        with _with_cuda_visible(ocr_device):
-            ocr = DeepSeekOCREngine(
-                model_name=ocr_model,
-                gpu_memory_utilization=gpu_mem_ocr,
-            )
+        with _with_cuda_visible(ocr_device, mps_env):
+            ocrs = [
+                DeepSeekOCREngine(
+                    model_name=ocr_model,
+                    gpu_memory_utilization=gpu_mem_ocr / ocr_replicas,
+                    quantization=ocr_quantization,
+                )
+                for _ in range(ocr_replicas)
+            ]
 
         # Image captioning model (Vision Language Model) (Pinning VL2 model to GPU1 or choiced device)
-        with _with_cuda_visible(vl2_device):
-            vl2 = DeepSeekVL2Captioner(
-                CaptionerConfig(
-                    model_name=vl2_model,
-                    gpu_memory_utilization=gpu_mem_vl2,
-                    seed=seed,
-                    min_side=128, # px
-                    max_side=2048 # px
+        with _with_cuda_visible(vl2_device, mps_env):
+            vl2s = [
+                DeepSeekVL2Captioner(
+                    CaptionerConfig(
+                        model_name=vl2_model,
+                        gpu_memory_utilization=gpu_mem_vl2 / vl2_replicas,
+                        max_num_seqs=vl2_max_num_seqs,
+                        mm_processor_cache_gb=vl2_mm_cache_gb,
+                        enable_prefix_caching=enable_prefix_caching,
+                        quantization=vl2_quantization,
+                        seed=seed,
+                        min_side=128, # px
+                        max_side=2048 # px
+                    )
                 )
-            )
+                for _ in range(vl2_replicas)
+            ]
+
+        # NOTE:
+        # vLLM's generate() returns only once the engine process is done, so by
+        # the time these calls return every kernel the first request needs is ready.
+        if warmup:
+            for engine in [*ocrs, *vl2s]:
+                engine.warmup()
+
+    # NOTE:
+    # Host-side work (page rendering, PNG encoding, image preprocessing) runs in
+    # these threads; keeping it on the GPU's NUMA node keeps host buffers local
+    # to the PCIe root the device copies from. Threads they start inherit it.
+    ocr_init = vl2_init = None
+    if pin_numa:
+        ocr_cpus = numa_local_cpus(ocr_device)
+        vl2_cpus = numa_local_cpus(vl2_device)
+        if ocr_cpus:
+            ocr_init = functools.partial(pin_current_thread, ocr_cpus)
+        if vl2_cpus:
+            vl2_init = functools.partial(pin_current_thread, vl2_cpus)
+        logger.info("NUMA pinning: OCR threads --> %s, VL2 threads --> %s", ocr_cpus, vl2_cpus)
+
+    ocr_pool: asyncio.Queue[DeepSeekOCREngine] = asyncio.Queue()
+    for ocr in ocrs:
+        ocr_pool.put_nowait(ocr)
 
     # Engine instance to serve requests
-    _engines = Engines(
-        ocr=ocr,
-        vl2=vl2,
+    engines = Engines(
+        ocr=ocrs[0],
+        vl2=vl2s[0],
         gate=asyncio.BoundedSemaphore(gpu_slots),
+        ocr_pool=ocr_pool,
+        caption_batcher=CaptionBatcher(
+            vl2s,
+            max_batch=caption_batch_max,
+            max_wait_ms=caption_batch_wait_ms,
+            thread_initializer=vl2_init,
+        ),
+        ocr_executor=ThreadPoolExecutor(
+            max_workers=gpu_slots,
+            thread_name_prefix="ocr-io",
+            initializer=ocr_init,
+        ),
+        caption_executor=ThreadPoolExecutor(
+            max_workers=gpu_slots,
+            thread_name_prefix="vl2-io",
+            initializer=vl2_init,
+        ),
+        scratch=ScratchPool(Path(work_root) if work_root else prepare_tmp_root(TMP_ROOT), size=gpu_slots * 2),
+        gpu_slots=gpu_slots,
+        caption_cache=(
+            CaptionCache(Path(caption_cache_dir), model_name=vl2s[0].cfg.model_name)
+            if caption_cache_dir else None
+        ),
     )
+    engines.caption_batcher.start()
+    set_engines(engines)
+
+def set_engines(engines: Optional[Engines]) -> Optional[Engines]:
+    """
+    Publish the engines every request uses, replacing the current ones.
+    Lets tests and tooling inject their own engines without loading models.
+
+    Args:
+        engines (Optional[Engines]): The engines to serve requests with; None unpublishes them.
+
+    Returns:
+        Optional[Engines]: The previously published engines, e.g. to restore them later.
+    """
+    # NOTE:
+    # A plain module global rather than a ContextVar: a value set in the
+    # lifespan task would not be visible to request tasks or executor threads.
+    global _engines
+    previous, _engines = _engines, engines
+    return previous
+
+def shutdown_engines() -> None:
+    """
+    Release process-wide engine resources on service shutdown: stop the
+    GPU worker threads and close the caption cache.
+    """
+    engines = set_engines(None)
+    if engines is None:
+        return
+    engines.caption_batcher.stop()
+    engines.ocr_executor.shutdown(wait=False, cancel_futures=True)
+    engines.caption_executor.shutdown(wait=False, cancel_futures=True)
+    if engines.caption_cache is not None:
+        engines.caption_cache.close()
 
 def get_engines() -> Engines:
     """
@@ -109,46 +373,66 @@ def engines_busy() -> bool:
         bool: True if the engines are busy, False otherwise.
     """
     e = get_engines()
-    return e.gate._value == 0
+    return e.in_flight >= e.gpu_slots
+
+def ocr_busy() -> bool:
+    """
+    Check if the OCR stage is fully occupied.
 
-async def try_admit_now() -> bool:
+    Returns:
+        bool: True if every OCR replica is rented by a job.
+    """
+    return get_engines().ocr_pool.empty()
+
+def vl2_busy() -> bool:
+    """
+    Check if every VL2 replica is working on a caption batch.
+
+    Returns:
+        bool: True if no replica is free for another batched caption call.
+    """
+    return get_engines().caption_batcher.busy
+
+async def try_admit_now() -> Optional[AdmissionSlot]:
     """
     Try to admit a new GPU job without waiting.
+    The returned slot must be held for the whole job.
 
     Returns:
-        bool: True if admitted, False if the gate is full.
+        Optional[AdmissionSlot]: The acquired slot, or None if the gate is full.
     """
     e = get_engines()
-    try:
-        # NOTE:
-        # Non-blocking probe via near-zero timeout
-        # If I set timeout=0, it always raises TimeoutError immediately,
-        # even though the resource is available. At least we have to give
-        # a minimal, trivail amount of time for the event loop to schedule.
-        await asyncio.wait_for(e.gate.acquire(), timeout=0.1)
-    except asyncio.TimeoutError:
-        return False
-    else:
-        # Immediately release after acquiring
-        e.gate.release()
-        return True
+    # NOTE:
+    # locked() is True exactly when acquire() would block. Otherwise acquire()
+    # returns without yielding to the event loop, so nobody can sneak in between.
+    if e.gate.locked():
+        return None
+    await e.gate.acquire()
+    return AdmissionSlot(e)
 
-async def try_admit_with_timeout(timeout_s: float) -> bool:
+async def try_admit_with_timeout(timeout_s: float) -> Optional[AdmissionSlot]:
     """
     Try to admit a new GPU job with a timeout.
+    The returned slot must be held for the whole job.
 
     Args:
         timeout_s (float): Timeout in seconds to wait for admission.
 
     Returns:
-        bool: True if admitted within the timeout, False otherwise.
+        Optional[AdmissionSlot]: The acquired slot, or None if not admitted within the timeout.
     """
     e = get_engines()
+    # NOTE:
+    # A free slot is taken right away. Before Python 3.12, wait_for() with a
+    # zero timeout cancels the acquire before it ever runs, rejecting a job
+    # even though the gate was open.
+    if not e.gate.locked():
+        await e.gate.acquire()
+        return AdmissionSlot(e)
+    if timeout_s <= 0:
+        return None
     try:
         await asyncio.wait_for(e.gate.acquire(), timeout=timeout_s)
     except asyncio.TimeoutError:
-        return False
-    else:
-        # Immediately release after acquiring
-        e.gate.release()
-        return True
+        return None
+    return AdmissionSlot(e)
@@ -0,0 +1,63 @@
+# service/mps.py
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import stat
+import subprocess
+from pathlib import Path
+
+logger = logging.getLogger("pdfscribe2ds")
+
+MPS_CONTROL = "nvidia-cuda-mps-control"
+# Where CUDA clients and the control daemon meet, unless CUDA_MPS_PIPE_DIRECTORY overrides it
+MPS_PIPE_DIRECTORY = "/tmp/nvidia-mps"
+
+def mps_control_pipe() -> Path:
+    """
+    Path of the MPS control pipe that CUDA clients of this process connect through.
+
+    Returns:
+        Path: `$CUDA_MPS_PIPE_DIRECTORY/control`, by default `/tmp/nvidia-mps/control`.
+    """
+    return Path(os.environ.get("CUDA_MPS_PIPE_DIRECTORY") or MPS_PIPE_DIRECTORY) / "control"
+
+def mps_daemon_running() -> bool:
+    """
+    Check whether a CUDA MPS control daemon is reachable from this process.
+    Detected by its control pipe rather than by process name, so a daemon in
+    another PID namespace (e.g. a sidecar container sharing the pipe
+    directory) is found as well.
+
+    Returns:
+        bool: True if the control pipe exists.
+    """
+    try:
+        return stat.S_ISFIFO(mps_control_pipe().stat().st_mode)
+    except OSError:
+        return False
+
+def ensure_mps_daemon() -> bool:
+    """
+    Start the CUDA MPS control daemon unless it already runs. With MPS, kernels
+    of the OCR and VL2 engine processes run side by side on a shared GPU instead
+    of time-slicing between their CUDA contexts.
+    Must run before any engine creates its CUDA context.
+
+    Returns:
+        bool: True if MPS is available, False if it could not be started.
+    """
+    if mps_daemon_running():
+        return True
+    if shutil.which(MPS_CONTROL) is None:
+        logger.warning("%s not found; engines sharing a GPU will time-slice", MPS_CONTROL)
+        return False
+    try:
+        # NOTE: `-d` forks the daemon and returns immediately
+        subprocess.run([MPS_CONTROL, "-d"], check=True, timeout=10, capture_output=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Failed to start the CUDA MPS daemon (%s); engines sharing a GPU will time-slice", e)
+        return False
+    logger.info("Started the CUDA MPS control daemon")
+    return True
@@ -0,0 +1,87 @@
+# service/numa.py
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional, Set
+
+logger = logging.getLogger("pdfscribe2ds")
+
+def _parse_cpulist(text: str) -> Set[int]:
+    """
+    Parse a kernel CPU list such as "0-15,32-47".
+
+    Args:
+        text (str): The CPU list.
+
+    Returns:
+        Set[int]: The listed CPU IDs.
+    """
+    cpus: Set[int] = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+def gpu_numa_node(device: str) -> Optional[int]:
+    """
+    Find the NUMA node a GPU's PCI device is attached to.
+
+    Args:
+        device (str): CUDA device ID(s) as configured; the first one is used.
+
+    Returns:
+        Optional[int]: The NUMA node, or None if it cannot be determined
+                       (no nvidia-smi, no sysfs, or a single-node machine).
+    """
+    if shutil.which("nvidia-smi") is None:
+        return None
+    try:
+        out = subprocess.run(
+            ["nvidia-smi", "--query-gpu=pci.bus_id", "--format=csv,noheader", "-i", device.split(",")[0].strip()],
+            check=True, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+        # "00000000:3B:00.0" --> "0000:3b:00.0"
+        bus_id = out.splitlines()[0].strip().lower()[-12:]
+        node = int((Path("/sys/bus/pci/devices") / bus_id / "numa_node").read_text())
+    except (OSError, ValueError, IndexError, subprocess.SubprocessError):
+        return None
+    return node if node >= 0 else None
+
+def numa_local_cpus(device: str) -> Optional[Set[int]]:
+    """
+    CPUs on the GPU's NUMA node that this process is allowed to run on.
+
+    Args:
+        device (str): CUDA device ID(s) as configured.
+
+    Returns:
+        Optional[Set[int]]: The CPU IDs, or None if pinning is not possible.
+    """
+    node = gpu_numa_node(device)
+    if node is None:
+        return None
+    try:
+        cpus = _parse_cpulist(Path(f"/sys/devices/system/node/node{node}/cpulist").read_text())
+    except (OSError, ValueError):
+        return None
+    cpus &= os.sched_getaffinity(0)
+    return cpus or None
+
+def pin_current_thread(cpus: Set[int]) -> None:
+    """
+    Restrict the calling thread to the given CPUs. Used as a thread pool
+    initializer; threads it starts later inherit the affinity.
+
+    Args:
+        cpus (Set[int]): The CPU IDs to run on.
+    """
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        logger.warning("Failed to pin thread to CPUs %s: %s", sorted(cpus), e)
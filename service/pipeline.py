@@ -2,33 +2,52 @@
 from __future__ import annotations
 
 import asyncio
-import uuid
-import shutil
-from typing import Optional
-from contextlib import asynccontextmanager
+import functools
+import anyio
+from typing import List, Optional, Tuple
 from pathlib import Path
 from fastapi import HTTPException
 
-from caption_pipeline.caption_pipeline import run_caption_pipeline, CaptionRewrite
+from caption_pipeline.caption_pipeline import caption_markdown_files, CaptionRewrite
 from ocr_pipeline.pipeline import run_pdf_pipeline
 from service.model_manager import get_engines
 
-@asynccontextmanager
-async def _admit():
-    """
-    Acquire admission to GPU for the entire job.
+_PAGE_BATCH = 8 # pages captioned together at most
+_PAGE_BATCH_WAIT_S = 0.5 # how long to wait for more OCR'd pages before captioning a partial batch
+
+async def _next_page_batch(pages: asyncio.Queue) -> Tuple[List[Path], bool]:
     """
-    e = get_engines()
-    await e.gate.acquire()
+    Take the next batch of OCR'd Markdown files off the queue. Waits for at least
+    one item, then briefly for more, up to `_PAGE_BATCH` files.
 
-    try:
-        yield
-    finally:
-        e.gate.release()
+    Args:
+        pages (asyncio.Queue): Queue of Markdown file paths; None marks the end.
+
+    Returns:
+        Tuple[List[Path], bool]: The batch, and whether the end marker was reached.
+    """
+    loop = asyncio.get_running_loop()
+    item = await pages.get()
+    deadline = loop.time() + _PAGE_BATCH_WAIT_S
+    batch: List[Path] = []
+    while item is not None:
+        batch.append(item)
+        if len(batch) >= _PAGE_BATCH:
+            return batch, False
+        if not pages.empty():
+            item = pages.get_nowait()
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return batch, False
+        try:
+            item = await asyncio.wait_for(pages.get(), timeout=remaining)
+        except asyncio.TimeoutError:
+            return batch, False
+    return batch, True
 
 async def process_pdf(
-    tmp_root: Path,
-    pdf_bytes: bytes,
+    pdf_path: Path,
     dpi: int,
     rewrite: CaptionRewrite,
     seed: int | None,
@@ -38,69 +57,113 @@ async def process_pdf(
     Asynchronously process a PDF: OCR + Caption.
     After work, return the output directory path.
     Inside the path, there will be per-page subdirectories with results.
+    The caller must hold an admission slot (see `service.model_manager.try_admit_now`)
+    for the duration of the call. The output lives in a directory rented from
+    `engines.scratch`; hand its parent back with `engines.scratch.give_back`
+    once the output is no longer needed.
 
     Args:
-        tmp_root (Path): Root temporary directory.
-        pdf_bytes (bytes): PDF file content in bytes.
+        pdf_path (Path): Path to the uploaded PDF file; it is read, never modified.
         dpi (int): DPI for OCR processing.
         rewrite (CaptionRewrite): Caption rewriting strategy.
         seed (int | None): Random seed for captioning.
-        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation.
+        cancel_evt (Optional[asyncio.Event]): Optional event to signal cancellation;
+                                              also set here if the job fails or is cancelled.
     """
+    engines = get_engines()
+    # Also stops the worker threads when this task fails or is cancelled
+    cancel_evt = cancel_evt or asyncio.Event()
+    if engines.ocr is None:
+        raise HTTPException(status_code=500, detail="OCR engine is not initialized")
+    if engines.vl2 is None:
+        raise HTTPException(status_code=500, detail="VL2 caption engine is not initialized")
+
     # Set up the directories
-    workdir = tmp_root / str(uuid.uuid4())
-    pdf_path = workdir / "input.pdf"
+    workdir = engines.scratch.rent()
     out_dir  = workdir / "output"
-    workdir.mkdir(parents=True, exist_ok=True)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    pdf_path.write_bytes(pdf_bytes)
-
-    engines = get_engines()
+    out_dir.mkdir(exist_ok=True)
 
     # NOTE:
-    # Entire GPU-critical path (OCR -> caption) under one admission lock
-    # After the job, the semaphore is released.
-    try:
-        async with _admit():
-            # 1. OCR
-            try:
-                if engines.ocr is None:
-                    raise HTTPException(status_code=500, detail="OCR engine is not initialized")
-                def _run_ocr():
-                    run_pdf_pipeline(
-                        pdf_path=pdf_path,
-                        output_dir=out_dir,
-                        ocr_engine=engines.ocr,
-                        dpi=dpi,
-                        cancel_evt=cancel_evt,
-                    )
-                await asyncio.to_thread(_run_ocr)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"OCR processing failed: {e!s}")
+    # OCR'd pages are handed to the caption stage as they are written, so VL2
+    # captions page N while OCR works on page N+1. Items are just file paths;
+    # an unbounded queue costs nothing and can never stall the OCR thread.
+    loop = asyncio.get_running_loop()
+    pages: asyncio.Queue[Optional[Path]] = asyncio.Queue()
 
-            # 2. Caption
+    # 1. OCR
+    async def _ocr_stage() -> None:
+        def _run_ocr(ocr):
+            run_pdf_pipeline(
+                pdf_path=pdf_path,
+                output_dir=out_dir,
+                ocr_engine=ocr,
+                dpi=dpi,
+                cancel_evt=cancel_evt,
+                on_page=lambda md_file: loop.call_soon_threadsafe(pages.put_nowait, md_file),
+            )
+        try:
+            # Rent an OCR replica for the whole stage
+            ocr = await engines.ocr_pool.get()
+            job = engines.ocr_executor.submit(_run_ocr, ocr)
+            # NOTE:
+            # The replica is returned when the OCR thread is done with it, not
+            # when this task is cancelled while the thread still drives the engine.
+            job.add_done_callback(lambda _: loop.call_soon_threadsafe(engines.ocr_pool.put_nowait, ocr))
+            await asyncio.wrap_future(job)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OCR processing failed: {e!s}")
+        finally:
+            # Queued after every page callback scheduled by the OCR thread
+            pages.put_nowait(None)
+
+    # 2. Caption, page batches as they arrive
+    async def _caption_stage() -> None:
+        failure: Optional[Exception] = None
+        done = False
+        while not done:
+            batch, done = await _next_page_batch(pages)
+            if not batch or failure is not None:
+                # Keep draining after a failure until OCR is finished
+                continue
             try:
-                if engines.vl2 is None:
-                    raise HTTPException(status_code=500, detail="VL2 caption engine is not initialized")
-                def _run_caption():
-                    run_caption_pipeline(
-                        output_dir=out_dir,
-                        captioner=engines.vl2,
-                        seed=seed,
+                await loop.run_in_executor(
+                    engines.caption_executor,
+                    functools.partial(
+                        caption_markdown_files,
+                        batch,
+                        engines.vl2,
                         rewrite=rewrite,
                         cancel_evt=cancel_evt,
-                    )
-                await asyncio.to_thread(_run_caption)
+                        caption_cache=engines.caption_cache,
+                        caption_fn=engines.caption_batcher.caption_prompts,
+                    ),
+                )
             except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Caption processing failed: {e!s}")
+                failure = e
+        if failure is not None:
+            raise HTTPException(status_code=500, detail=f"Caption processing failed: {failure!s}")
 
-    except asyncio.CancelledError:
-        # Best-effort cleanup of the working directory in case of cancellation
+    # NOTE:
+    # Entire GPU-critical path (OCR -> caption) runs under the caller's
+    # admission slot, which is released once the job is over. Within it, only
+    # OCR rents an engine; captions go through the shared batcher, so OCR and VL2
+    # (pinned to different GPUs) can serve several admitted jobs at the same time.
+    try:
+        caption_task = asyncio.create_task(_caption_stage())
         try:
-            shutil.rmtree(workdir, ignore_errors=True)
-        finally:
-            pass
+            await _ocr_stage()
+        except BaseException:
+            caption_task.cancel()
+            raise
+        await caption_task
+    except BaseException:
+        cancel_evt.set()
+        # NOTE:
+        # A stage's worker thread may still be finishing its current page, so
+        # the directory is dropped rather than returned to the pool for reuse.
+        # Shielded so a cancelled request still cleans up.
+        with anyio.CancelScope(shield=True):
+            await engines.scratch.discard(workdir)
         raise
 
-
     return out_dir
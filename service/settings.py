@@ -6,6 +6,8 @@ class Settings(BaseSettings):
     # Models
     model_ocr: str = "deepseek-ai/DeepSeek-OCR"
     model_vl2: str = "deepseek-ai/deepseek-vl2-tiny"
+    model_vl2_quant: str | None = None  # vLLM quantization for VL2, e.g. "fp8", "awq", "bitsandbytes"
+    model_ocr_quant: str | None = None  # vLLM quantization for OCR, e.g. "fp8"
 
     # GPU memory split
     gpu_mem_ocr: float = 0.70
@@ -15,9 +17,35 @@ class Settings(BaseSettings):
     ocr_device: str = "0"
     vl2_device: str = "1"
 
+    # NOTE: Pin OCR/VL2 worker threads to CPUs on their GPU's NUMA node (multi-socket hosts)
+    pin_numa: bool = False
+
+    # CUDA MPS
+    # NOTE: Only used when OCR and VL2 share a GPU; starts the MPS daemon if it isn't running
+    enable_mps: bool = False
+    mps_thread_percentage: int = 50  # share of SMs each engine may use under MPS
+
     # Admission control
     # NOTE: Not to overwhelm a limited resource with too many concurrent jobs
     gpu_slots: int = 1  # number of concurrent GPU jobs allowed (1 for single GPU)
+    ocr_replicas: int = 1  # OCR engine instances (jobs OCR'd at once); GPU_MEM_OCR is split across them
+    vl2_replicas: int = 1  # VL2 engine instances (caption batches at once); GPU_MEM_VL2 is split across them
+    caption_batch_max: int = 16  # images per VL2 call, merged across concurrent jobs
+    caption_batch_wait_ms: float = 15.0  # how long to wait for more images before a partial VL2 call
+    vl2_max_num_seqs: int = 8  # images captioned concurrently within one VL2 batch
+    vl2_mm_cache_gb: float = 4.0  # VL2 processed-image cache keyed by content hash (0 disables)
+    enable_prefix_caching: bool = True  # reuse the VL2 KV cache of the shared caption prompt prefix
     seed: int | None = None
+    warmup: bool = True  # run a tiny OCR + caption pass at startup so the first request doesn't pay for it
+
+    # Work directory housekeeping
+    # NOTE: Point at a tmpfs (e.g. /dev/shm/pdfscribe2ds-fastapi) to keep uploads and page assets off disk
+    tmp_root: str = "/tmp/pdfscribe2ds-fastapi"
+    stale_workdir_minutes: int = 60  # leftovers older than this are removed at startup
+
+    # Caption cache
+    # NOTE: Opt-in; reuses captions of identical images across pages and PDFs
+    caption_cache_enabled: bool = False
+    caption_cache_dir: str = "/tmp/pdfscribe2ds-fastapi/caption_cache"
 
     model_config = SettingsConfigDict(env_prefix="", env_file=None, extra="ignore")
@@ -1,10 +1,237 @@
 # service/workers.py
 from __future__ import annotations
 
+import asyncio
+import os
 import shutil
+import stat
+import tempfile
+import time
+import uuid
+import zipfile
 from pathlib import Path
+from typing import BinaryIO, Tuple
 
-def zip_dir(src: Path, dest_zip_stem: Path) -> Path:
+# Default root for per-request work directories and uploaded PDFs
+TMP_ROOT = Path("/tmp/pdfscribe2ds-fastapi")
+# Subdirectory of the root that the service owns outright; nothing outside it is ever removed
+WORK_DIRNAME = "work"
+UPLOAD_PREFIX = "upload-"
+
+# Already-compressed formats; deflating them again only burns CPU
+_STORED_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".webp", ".gif"})
+
+def save_upload(src: BinaryIO, work_root: Path, chunk_size: int = 1 << 20) -> Tuple[Path, int]:
+    """
+    Copy an uploaded PDF into the work root in fixed-size chunks, so memory use
+    stays at one chunk regardless of the file size. Blocking; run it in a thread.
+
+    Args:
+        src (BinaryIO): The upload's underlying file object.
+        work_root (Path): The work root directory.
+        chunk_size (int): Bytes copied per read/write.
+
+    Returns:
+        Tuple[Path, int]: Path of the stored file and its size in bytes.
+    """
+    src.seek(0)
+    with tempfile.NamedTemporaryFile(dir=work_root, prefix=UPLOAD_PREFIX, suffix=".pdf", delete=False) as tf:
+        try:
+            shutil.copyfileobj(src, tf, chunk_size)
+        except BaseException:
+            os.unlink(tf.name)
+            raise
+        return Path(tf.name), tf.tell()
+
+def prepare_tmp_root(tmp_root: Path) -> Path:
+    """
+    Create the service's work root: a dedicated subdirectory of `tmp_root`,
+    readable by the service user only. `tmp_root` itself may be shared (e.g.
+    /tmp or /dev/shm); it is created if missing but its mode is never changed.
+
+    Args:
+        tmp_root (Path): The configured temporary directory.
+
+    Returns:
+        Path: The work root for uploads and job directories.
+
+    Raises:
+        RuntimeError: If the work root exists but is not a directory owned by this user.
+    """
+    tmp_root.mkdir(mode=0o700, parents=True, exist_ok=True)
+    work_root = tmp_root / WORK_DIRNAME
+    try:
+        work_root.mkdir(mode=0o700)
+    except FileExistsError:
+        st = work_root.lstat()
+        if not stat.S_ISDIR(st.st_mode) or (hasattr(os, "getuid") and st.st_uid != os.getuid()):
+            raise RuntimeError(f"{work_root} is not a directory owned by this user; refusing to use it")
+    return work_root
+
+def _is_stale_entry(entry: os.DirEntry) -> bool:
+    """
+    Whether a directory entry under the work root was created by a request:
+    a UUID-named work directory or an uploaded PDF.
+
+    Args:
+        entry (os.DirEntry): Entry under the work root.
+
+    Returns:
+        bool: True if the entry belongs to a (possibly abandoned) request.
+    """
+    if entry.is_dir(follow_symlinks=False):
+        try:
+            uuid.UUID(entry.name)
+        except ValueError:
+            return False
+        return True
+    return entry.name.startswith(UPLOAD_PREFIX)
+
+def sweep_stale(work_root: Path, max_age_s: float) -> int:
+    """
+    Remove request leftovers older than max_age_s from the work root, e.g.
+    when a previous process died mid-request. Other entries are left untouched.
+
+    Args:
+        work_root (Path): The work root directory.
+        max_age_s (float): Minimum age in seconds before an entry is removed.
+
+    Returns:
+        int: Number of removed entries.
+    """
+    if not work_root.is_dir():
+        return 0
+
+    cutoff = time.time() - max_age_s
+    removed = 0
+    with os.scandir(work_root) as it:
+        for entry in it:
+            try:
+                if not _is_stale_entry(entry) or entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                removed += 1
+            except OSError:
+                continue
+    return removed
+
+def _clear_dir(path: Path) -> None:
+    """
+    Remove everything inside a directory, keeping the directory itself.
+
+    Args:
+        path (Path): Directory to empty.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+class ScratchPool:
+    """
+    Reusable per-job work directories under `<work_root>/pool`. A job rents one
+    and it is given back emptied, so steady-state requests reuse existing
+    directories instead of creating and removing a fresh tree each time.
+    When every directory is rented out, a one-off UUID directory is handed
+    out instead of making the job wait.
+    """
+    def __init__(self, work_root: Path, size: int) -> None:
+        """
+        Args:
+            work_root (Path): The work root directory.
+            size (int): Number of pooled directories.
+        """
+        self.work_root = work_root
+        self.root = work_root / "pool"
+        # Leftovers of a previous process
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._free: asyncio.Queue[Path] = asyncio.Queue()
+        for _ in range(size):
+            self._free.put_nowait(self._new_slot())
+
+    def _new_slot(self) -> Path:
+        """
+        Create a fresh pooled directory.
+
+        Returns:
+            Path: The new directory.
+        """
+        slot = self.root / f"slot-{uuid.uuid4().hex}"
+        slot.mkdir()
+        return slot
+
+    def rent(self) -> Path:
+        """
+        Take an empty work directory.
+
+        Returns:
+            Path: A pooled directory, or a new UUID directory if none is free.
+        """
+        try:
+            return self._free.get_nowait()
+        except asyncio.QueueEmpty:
+            workdir = self.work_root / str(uuid.uuid4())
+            workdir.mkdir()
+            return workdir
+
+    async def give_back(self, workdir: Path) -> None:
+        """
+        Return a directory once nothing uses it anymore. Pooled directories are
+        emptied and reused; one-off directories are removed.
+
+        Args:
+            workdir (Path): Directory obtained from `rent`.
+        """
+        if workdir.parent != self.root:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+            return
+        await asyncio.to_thread(_clear_dir, workdir)
+        self._free.put_nowait(workdir)
+
+    async def discard(self, workdir: Path) -> None:
+        """
+        Remove a directory that may still be written to, e.g. by a worker thread
+        of a failed job, and replace it in the pool with a fresh one.
+
+        Args:
+            workdir (Path): Directory obtained from `rent`.
+        """
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+        if workdir.parent == self.root:
+            self._free.put_nowait(await asyncio.to_thread(self._new_slot))
+
+def _iter_tree(root: Path, rel: str = ""):
+    """
+    Walk a directory tree depth-first with os.scandir, in name order.
+
+    Args:
+        root (Path): Directory to walk.
+        rel (str): Archive path prefix of `root`.
+
+    Yields:
+        Tuple[str, str]: (filesystem path, archive name) per entry; directory names end with "/".
+    """
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        arcname = f"{rel}{entry.name}"
+        if entry.is_dir(follow_symlinks=False):
+            yield entry.path, arcname + "/"
+            yield from _iter_tree(Path(entry.path), arcname + "/")
+        elif entry.is_file():
+            yield entry.path, arcname
+
+def zip_dir(src: Path, dest_zip_stem: Path, compress: bool = False) -> Path:
     """
     Zip a directory. dest_zip_stem is the path *without* .zip extension.
     Returns the final .zip Path.
@@ -12,10 +239,32 @@ def zip_dir(src: Path, dest_zip_stem: Path) -> Path:
     Args:
         src (Path): Source directory to zip.
         dest_zip_stem (Path): Destination zip file path without .zip extension.
+        compress (bool): Deflate text members (level 1) instead of storing them as-is.
+                         Images are always stored.
 
     Returns:
         Path: Path to the created zip file.
     """
-    archive = shutil.make_archive(str(dest_zip_stem), "zip", root_dir=src)
-    return Path(archive)
-
+    # NOTE:
+    # The archive is short-lived transport and most of its bytes are PNGs,
+    # which deflate cannot shrink further; storing them skips the CPU-bound
+    # compression pass that dominated post-processing.
+    archive = dest_zip_stem.with_name(dest_zip_stem.name + ".zip")
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    # NOTE:
+    # Paths are passed explicitly, never via the working directory, so concurrent
+    # archives from the thread pool cannot interfere. Non-strict timestamps keep
+    # files with pre-1980 mtimes (e.g. from SOURCE_DATE_EPOCH=0) from aborting the archive.
+    with zipfile.ZipFile(
+        archive,
+        "w",
+        compression=compression,
+        compresslevel=1 if compress else None,
+        strict_timestamps=False,
+    ) as zf:
+        for path, arcname in _iter_tree(src):
+            if compress and os.path.splitext(arcname)[1].lower() in _STORED_SUFFIXES:
+                zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+            else:
+                zf.write(path, arcname)
+    return archive